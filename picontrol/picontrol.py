@@ -2,7 +2,6 @@ import sys, os, time, json, subprocess, ConfigParser
 import RPi.GPIO as GPIO
 import picontrol_processes as procs
 import picontrol_nfc as nfc
-import picontrol_ndef as ndef
 
 def getConfig():
     config = ConfigParser.RawConfigParser()
@@ -34,5 +33,6 @@ else:
 response = nfc.read()
             
 if response.type == 'success':
-    message = response.data
-    procs.runGame(message.records[0].value, message.records[1].value, 'nfc')
\ No newline at end of file
+    game = nfc.gameFromMessage(response.data)
+    if game is not None:
+        procs.runGame(game[0], game[1], 'nfc')
\ No newline at end of file
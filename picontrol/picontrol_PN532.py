@@ -20,12 +20,37 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import binascii
-from functools import reduce
+import bisect
+from collections import deque
+from itertools import islice
+import json
 import logging
+import threading
 import time
 
-import Adafruit_GPIO as GPIO
-import Adafruit_GPIO.SPI as SPI
+try:
+    import Adafruit_GPIO as GPIO
+    import Adafruit_GPIO.SPI as SPI
+except ImportError:
+    # Adafruit_GPIO is only needed to drive the board's own pins.  Without it
+    # a gpio and spi have to be passed in, like picontrol_nfc_sim's simulated
+    # PN532, and these stand-ins provide the constants the driver uses.
+    class GPIO(object):
+        OUT = 0
+        IN = 1
+        FALLING = 2
+        PUD_UP = 2
+
+        @staticmethod
+        def get_platform_gpio():
+            raise RuntimeError('Adafruit_GPIO is required to use the board GPIO!')
+
+    class SPI(object):
+        LSBFIRST = 1
+
+        @staticmethod
+        def BitBang(gpio, sclk, mosi, miso):
+            raise RuntimeError('Adafruit_GPIO is required to use software SPI!')
 
 
 PN532_PREAMBLE                      = 0x00
@@ -94,6 +119,22 @@ MIFARE_CMD_INCREMENT                = 0xC1
 MIFARE_CMD_STORE                    = 0xC2
 MIFARE_ULTRALIGHT_CMD_WRITE         = 0xA2
 
+# NTAG21x Commands
+NTAG2XX_CMD_FAST_READ               = 0x3A
+NTAG2XX_CMD_GET_VERSION             = 0x60
+
+# RFConfiguration items
+PN532_CFGITEM_RF_FIELD              = 0x01
+PN532_CFGITEM_TIMINGS               = 0x02
+PN532_CFGITEM_MAX_RETRY_COM         = 0x04
+PN532_CFGITEM_MAX_RETRIES           = 0x05
+
+# Passive activation retries value that makes the PN532 retry until a card
+# is found or the command is aborted.
+PN532_RETRIES_FOREVER               = 0xFF
+# FAST_READ pages per frame, the response has to fit a normal PN532 frame
+NTAG2XX_FAST_READ_MAX_PAGES         = 60
+
 # Prefixes for NDEF Records (to identify record type)
 NDEF_URIPREFIX_NONE                 = 0x00
 NDEF_URIPREFIX_HTTP_WWWDOT          = 0x01
@@ -146,20 +187,121 @@ PN532_FRAME_START                   = bytearray([0x01, 0x00, 0x00, 0xFF])
 logger = logging.getLogger(__name__)
 
 
+class CommandTrace(object):
+    """Timing of the commands sent through PN532.call_function.  The last size
+    commands are kept in a ring with their command code, parameter and
+    response byte counts, ACK latency (frame write until the ACK was read),
+    response latency (ACK until the response was read) and total time, and
+    every command adds its total time to a histogram of that command code.
+    Enable it with PN532.enable_trace().
+    """
+
+    # Upper bounds in milliseconds of the histogram buckets, the last bucket
+    # counts everything slower.
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self, size=256):
+        self._lock = threading.Lock()
+        self._entries = deque(maxlen=size)
+        self._histograms = {}
+
+    def record(self, command, params_len, response, started, marks, result):
+        """Record a call_function call that started at started (time.time())
+        and reached the ACK and the response at the times in marks.
+        """
+        finished = time.time()
+        entry = {
+            'time': time.time(),
+            'command': command,
+            'name': command_name(command),
+            'bytes_out': params_len,
+            'bytes_in': len(response) if response is not None else 0,
+            'ack_ms': round((marks[0] - started)*1000.0, 3) if len(marks) > 0 else None,
+            'response_ms': round((marks[1] - marks[0])*1000.0, 3) if len(marks) > 1 else None,
+            'total_ms': round((finished - started)*1000.0, 3),
+            'result': result,
+        }
+        with self._lock:
+            self._entries.append(entry)
+            histogram = self._histograms.get(command)
+            if histogram is None:
+                histogram = self._histograms[command] = {
+                    'name': entry['name'], 'count': 0, 'total_ms': 0.0,
+                    'min_ms': None, 'max_ms': None, 'errors': 0,
+                    'buckets': [0]*(len(self.BUCKETS_MS) + 1)}
+            total_ms = entry['total_ms']
+            histogram['count'] += 1
+            histogram['total_ms'] += total_ms
+            if histogram['min_ms'] is None or total_ms < histogram['min_ms']:
+                histogram['min_ms'] = total_ms
+            if histogram['max_ms'] is None or total_ms > histogram['max_ms']:
+                histogram['max_ms'] = total_ms
+            if result != 'ok':
+                histogram['errors'] += 1
+            histogram['buckets'][bisect.bisect_left(self.BUCKETS_MS, total_ms)] += 1
+
+    def entries(self):
+        """Return the recorded commands, oldest first."""
+        with self._lock:
+            return list(self._entries)
+
+    def histograms(self):
+        """Return the histogram of every command code as a dict keyed by the
+        command code, the buckets count the calls up to each BUCKETS_MS bound.
+        """
+        with self._lock:
+            return dict((command, dict(histogram, buckets=list(histogram['buckets'])))
+                        for command, histogram in self._histograms.items())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._histograms = {}
+
+    def to_json(self):
+        """Return the ring and the histograms as a JSON string."""
+        histograms = dict(('0x{0:02X}'.format(command), histogram)
+                          for command, histogram in self.histograms().items())
+        return json.dumps({'buckets_ms': list(self.BUCKETS_MS),
+                           'entries': self.entries(),
+                           'histograms': histograms}, sort_keys=True)
+
+    def dump(self, path):
+        """Write the JSON of to_json() to the file at path."""
+        with open(path, 'w') as f:
+            f.write(self.to_json())
+
+
+_command_names = None
+
+def command_name(command):
+    """Return the name of a PN532 command code, like INLISTPASSIVETARGET."""
+    global _command_names
+    if _command_names is None:
+        _command_names = dict((value, name[len('PN532_COMMAND_'):])
+                              for name, value in globals().items()
+                              if name.startswith('PN532_COMMAND_'))
+    return _command_names.get(command, '0x{0:02X}'.format(command))
+
+
 class PN532(object):
     """PN532 breakout board representation.  Requires a SPI connection to the
-    breakout board.  A software SPI connection is recommended as the hardware
-    SPI on the Raspberry Pi has some issues with the LSB first mode used by the
-    PN532 (see: http://www.raspberrypi.org/forums/viewtopic.php?f=32&t=98070&p=720659#p720659)
+    breakout board.  The hardware SPI on the Raspberry Pi does not support the
+    LSB first mode used by the PN532 (see: http://www.raspberrypi.org/forums/viewtopic.php?f=32&t=98070&p=720659#p720659),
+    so either use software SPI or picontrol_spi.SpiDevLSB, which drives the
+    hardware SPI and reverses the bit order in software.
     """
 
     def __init__(self, cs, sclk=None, mosi=None, miso=None, gpio=None,
-                 spi=None):
+                 spi=None, irq=None, clock_hz=1000000, bus_lock=None):
         """Create an instance of the PN532 class using either software SPI (if
         the sclk, mosi, and miso pins are specified) or hardware SPI if a
         spi parameter is passed.  The cs pin must be a digital GPIO pin.
         Optionally specify a GPIO controller to override the default that uses
-        the board's GPIO pins.
+        the board's GPIO pins.  Clock_hz sets the hardware SPI clock.  If the
+        irq pin is given the PN532 IRQ line is used to wait for responses
+        instead of polling the SPI status byte.  When other chips share the SPI
+        bus pass the same bus_lock to all of them, it is held while CS is low.
         """
         # Default to platform GPIO if not provided.
         self._gpio = gpio
@@ -167,14 +309,29 @@ class PN532(object):
             self._gpio = GPIO.get_platform_gpio()
         # Initialize CS line.
         self._cs = cs
+        self._bus_lock = bus_lock
+        if self._bus_lock is None:
+            self._bus_lock = threading.RLock()
         self._gpio.setup(self._cs, GPIO.OUT)
         self._gpio.set_high(self._cs)
+        # Command timing, see enable_trace().
+        self._trace = None
+        # Reusable frame buffers keyed by length.
+        self._write_buffers = {}
+        self._read_buffers = {}
+        # Initialize IRQ line, the PN532 pulls it low when a response is ready.
+        self._irq = irq
+        self._irq_event = threading.Event()
+        if self._irq is not None:
+            self._gpio.setup(self._irq, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+            self._gpio.add_event_detect(self._irq, GPIO.FALLING,
+                                        callback=self._irq_callback)
         # Setup SPI provider.
         if spi is not None:
             logger.debug('Using hardware SPI.')
             # Handle using hardware SPI.
             self._spi = spi
-            self._spi.set_clock_hz(1000000)
+            self._spi.set_clock_hz(clock_hz)
         else:
             logger.debug('Using software SPI')
             # Handle using software SPI.  Note that the CS/SS pin is not used
@@ -189,65 +346,102 @@ class PN532(object):
         """Add add two values as unsigned 8-bit values."""
         return ((a & 0xFF) + (b & 0xFF)) & 0xFF
 
-    def _busy_wait_ms(self, ms):
-        """Busy wait for the specified number of milliseconds."""
-        start = time.time()
-        delta = ms/1000.0
-        while (time.time() - start) <= delta:
-            pass
+    def _sleep_ms(self, ms):
+        """Sleep for the specified number of milliseconds."""
+        time.sleep(ms/1000.0)
 
-    def _write_frame(self, data):
-        """Write a frame to the PN532 with the specified data bytearray."""
-        assert data is not None and 0 < len(data) < 255, 'Data must be array of 1 to 255 bytes.'
+    def _irq_callback(self, pin):
+        """Edge callback for the IRQ line."""
+        self._irq_event.set()
+
+    def close(self):
+        """Release the IRQ edge detection and close the SPI transport (if it
+        can be closed, like a spidev device) so a new PN532 instance can be
+        created for the same pins, e.g. when the reader is re-initialized
+        after an error.  The instance must not be used afterwards.
+        """
+        if self._irq is not None:
+            try:
+                self._gpio.remove_event_detect(self._irq)
+            except Exception:
+                pass
+            self._irq = None
+        close = getattr(self._spi, 'close', None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+    def _buffer(self, buffers, length):
+        """Return the reusable bytearray of the specified length from buffers,
+        allocating it the first time that length is needed.  Frames only come
+        in a handful of sizes so this keeps the codec from allocating a new
+        buffer for every transfer.
+        """
+        buf = buffers.get(length)
+        if buf is None:
+            buf = buffers[length] = bytearray(length)
+        return buf
+
+    def _write_frame(self, command, params=()):
+        """Write a frame to the PN532 holding the specified command byte and
+        its parameter bytes.
+        """
+        length = len(params)+2
+        assert length < 255, 'Params must be array of up to 252 bytes.'
         # Build frame to send as:
         # - SPI data write (0x01)
         # - Preamble (0x00)
         # - Start code  (0x00, 0xFF)
         # - Command length (1 byte)
         # - Command length checksum
-        # - Command bytes
+        # - Command bytes (direction, command and params)
         # - Checksum
         # - Postamble (0x00)
-        length = len(data)
-        frame = bytearray(length+8)
+        # Every byte is rewritten, so the buffer can be reused between frames.
+        frame = self._buffer(self._write_buffers, length+8)
         frame[0] = PN532_SPI_DATAWRITE
         frame[1] = PN532_PREAMBLE
         frame[2] = PN532_STARTCODE1
         frame[3] = PN532_STARTCODE2
-        frame[4] = length & 0xFF
-        frame[5] = self._uint8_add(~length, 1)
-        frame[6:-2] = data
-        checksum = reduce(self._uint8_add, data, 0xFF)
-        frame[-2] = ~checksum & 0xFF
+        frame[4] = length
+        frame[5] = -length & 0xFF
+        frame[6] = PN532_HOSTTOPN532
+        frame[7] = command & 0xFF
+        frame[8:-2] = params
+        frame[-2] = -(PN532_HOSTTOPN532 + frame[7] + sum(params)) & 0xFF
         frame[-1] = PN532_POSTAMBLE
         # Send frame.
-        logger.debug('Write frame: 0x{0}'.format(binascii.hexlify(frame)))
-        self._gpio.set_low(self._cs)
-        self._busy_wait_ms(2)
-        self._spi.write(frame)
-        self._gpio.set_high(self._cs)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Write frame: 0x{0}'.format(binascii.hexlify(frame)))
+        with self._bus_lock:
+            self._gpio.set_low(self._cs)
+            self._sleep_ms(2)
+            self._spi.write(frame)
+            self._gpio.set_high(self._cs)
 
     def _read_data(self, count):
         """Read a specified count of bytes from the PN532."""
-        # Build a read request frame.
-        frame = bytearray(count)
+        # The read request frame is the data read byte followed by zeros, it
+        # never changes so one is kept for each count.
+        frame = self._buffer(self._read_buffers, count)
         frame[0] = PN532_SPI_DATAREAD
         # Send the frame and return the response, ignoring the SPI header byte.
-        self._gpio.set_low(self._cs)
-        self._busy_wait_ms(2)
-        response = self._spi.transfer(frame)
-        self._gpio.set_high(self._cs)
+        with self._bus_lock:
+            self._gpio.set_low(self._cs)
+            self._sleep_ms(2)
+            response = self._spi.transfer(frame)
+            self._gpio.set_high(self._cs)
         return response
 
-    def _read_frame(self, length):
-        """Read a response frame from the PN532 of at most length bytes in size.
-        Returns the data inside the frame if found, otherwise raises an exception
-        if there is an error parsing the frame.  Note that less than length bytes
-        might be returned!
+    def _parse_frame(self, response):
+        """Check the response frame read from the PN532 and return the start
+        and end index of the data inside it.  Raises an exception if there is
+        an error parsing the frame.
         """
-        # Read frame with expected length of data.
-        response = self._read_data(length+8)
-        logger.debug('Read frame: 0x{0}'.format(binascii.hexlify(response)))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Read frame: 0x{0}'.format(binascii.hexlify(response)))
         # Check frame starts with 0x01 and then has 0x00FF (preceeded by optional
         # zeros).
         if response[0] != 0x01:
@@ -267,12 +461,44 @@ class PN532(object):
         frame_len = response[offset]
         if (frame_len + response[offset+1]) & 0xFF != 0:
             raise RuntimeError('Response length checksum did not match length!')
-        # Check frame checksum value matches bytes.
-        checksum = reduce(self._uint8_add, response[offset+2:offset+2+frame_len+1], 0)
-        if checksum != 0:
+        # Check frame checksum value matches bytes, summing in place instead
+        # of slicing a copy of the data.
+        start = offset+2
+        end = start+frame_len
+        if sum(islice(response, start, end+1)) & 0xFF != 0:
             raise RuntimeError('Response checksum did not match expected value!')
+        return start, end
+
+    def _read_frame(self, length):
+        """Read a response frame from the PN532 of at most length bytes in size.
+        Returns the data inside the frame if found, otherwise raises an exception
+        if there is an error parsing the frame.  Note that less than length bytes
+        might be returned!
+        """
+        # Read frame with expected length of data.
+        response = self._read_data(length+8)
+        start, end = self._parse_frame(response)
         # Return frame data.
-        return response[offset+2:offset+2+frame_len]
+        return response[start:end]
+
+    def _abort(self):
+        """Abort the command the PN532 is processing by sending it an ACK."""
+        with self._bus_lock:
+            self._gpio.set_low(self._cs)
+            self._sleep_ms(2)
+            self._spi.write(PN532_ACK)
+            self._gpio.set_high(self._cs)
+
+    def _read_status(self):
+        """Send a SPI status read command and return True if the PN532 has
+        signalled that it is ready.
+        """
+        with self._bus_lock:
+            self._gpio.set_low(self._cs)
+            self._sleep_ms(2)
+            response = self._spi.transfer([PN532_SPI_STATREAD, 0x00])
+            self._gpio.set_high(self._cs)
+        return response[1] == PN532_SPI_READY
 
     def _wait_ready(self, timeout_sec=1):
         """Wait until the PN532 is ready to receive commands.  At most wait
@@ -280,25 +506,64 @@ class PN532(object):
         before the timeout is exceeded then True will be returned, otherwise
         False is returned when the timeout is exceeded.
         """
-        start = time.time()
-        # Send a SPI status read command and read response.
-        self._gpio.set_low(self._cs)
-        self._busy_wait_ms(2)
-        response = self._spi.transfer([PN532_SPI_STATREAD, 0x00])
-        self._gpio.set_high(self._cs)
-        # Loop until a ready response is received.
-        while response[1] != PN532_SPI_READY:
+        if self._irq is not None:
+            return self._wait_irq(timeout_sec)
+        # Poll the status byte, backing off from 1ms up to 10ms between reads.
+        # The timeout counts the time slept, so a clock step can not stretch it.
+        delay = 0.001
+        waited = 0
+        while not self._read_status():
             # Check if the timeout has been exceeded.
-            if time.time() - start >= timeout_sec:
+            if waited >= timeout_sec:
                 return False
             # Wait a little while and try reading the status again.
-            time.sleep(0.01)
-            self._gpio.set_low(self._cs)
-            self._busy_wait_ms(2)
-            response = self._spi.transfer([PN532_SPI_STATREAD, 0x00])
-            self._gpio.set_high(self._cs)
+            time.sleep(min(delay, timeout_sec - waited))
+            waited += delay
+            delay = min(delay*2, 0.01)
         return True
 
+    def _wait_irq(self, timeout_sec):
+        """Wait up to timeout_sec seconds for the IRQ line to go low.  A timed
+        Event.wait polls with up to 50ms sleeps on Python 2, so the wait blocks
+        untimed and a timer releases it at the timeout instead.
+        """
+        # IRQ stays low until the response is read, so check the level first
+        # and only block on the falling edge if it is not low yet.
+        if self._gpio.is_low(self._irq):
+            return True
+        expired = []
+        def expire():
+            expired.append(True)
+            self._irq_event.set()
+        timer = threading.Timer(timeout_sec, expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            while not self._gpio.is_low(self._irq):
+                if expired:
+                    return False
+                self._irq_event.wait()
+                self._irq_event.clear()
+            return True
+        finally:
+            timer.cancel()
+
+    def enable_trace(self, size=256):
+        """Start recording the timing of every command in a CommandTrace ring
+        of size entries and return the trace.
+        """
+        self._trace = CommandTrace(size)
+        return self._trace
+
+    def disable_trace(self):
+        """Stop recording command timings."""
+        self._trace = None
+
+    @property
+    def trace(self):
+        """The CommandTrace if tracing is enabled, otherwise None."""
+        return self._trace
+
     def call_function(self, command, response_length=0, params=[], timeout_sec=1):
         """Send specified command to the PN532 and expect up to response_length
         bytes back in a response.  Note that less than the expected bytes might
@@ -307,40 +572,77 @@ class PN532(object):
         for a response and return a bytearray of response bytes, or None if no
         response is available within the timeout.
         """
-        # Build frame data with command and parameters.
-        data = bytearray(2+len(params))
-        data[0]  = PN532_HOSTTOPN532
-        data[1]  = command & 0xFF
-        data[2:] = params
-        # Send frame and wait for response.
-        self._write_frame(data)
+        trace = self._trace
+        if trace is None:
+            return self._call_function(command, response_length, params, timeout_sec)
+        started = time.time()
+        marks = []
+        response = None
+        result = 'error'
+        try:
+            response = self._call_function(command, response_length, params, timeout_sec, marks)
+            result = 'ok' if response is not None else 'timeout'
+            return response
+        finally:
+            trace.record(command, len(params), response, started, marks, result)
+
+    def _call_function(self, command, response_length, params, timeout_sec, marks=None):
+        """Run call_function, appending the time the ACK and the response were
+        read to marks if it is a list.
+        """
+        # Send frame with command and parameters and wait for response.
+        self._write_frame(command, params)
         if not self._wait_ready(timeout_sec):
             return None
         # Verify ACK response and wait to be ready for function response.
         response = self._read_data(len(PN532_ACK))
         if response != PN532_ACK:
             raise RuntimeError('Did not receive expected ACK from PN532!')
+        if marks is not None:
+            marks.append(time.time())
         if not self._wait_ready(timeout_sec):
+            # Cancel the command so the PN532 accepts the next one, otherwise
+            # a pending InListPassiveTarget keeps it busy looking for a card.
+            self._abort()
             return None
         # Read response bytes.
-        response = self._read_frame(response_length+2)
+        response = self._read_data(response_length+10)
+        if marks is not None:
+            marks.append(time.time())
+        start, end = self._parse_frame(response)
         # Check that response is for the called function.
-        if not (response[0] == PN532_PN532TOHOST and response[1] == (command+1)):
+        if not (end - start >= 2 and response[start] == PN532_PN532TOHOST
+                and response[start+1] == (command+1) & 0xFF):
             raise RuntimeError('Received unexpected command response!')
-        # Return response data.
-        return response[2:]
+        # Return response data, the only copy made of the frame.
+        return response[start+2:end]
 
     def begin(self):
         """Initialize communication with the PN532.  Must be called before any
         other calls are made against the PN532.
         """
-        # Assert CS pin low for a second for PN532 to be ready.
-        self._gpio.set_low(self._cs)
+        # Wake the PN532 with a short CS pulse.  The bus lock is only held for
+        # the pulse, the other readers on the bus keep working while this one
+        # takes a second to come up and answers (or times out) the probe.
+        with self._bus_lock:
+            self._gpio.set_low(self._cs)
+            self._sleep_ms(2)
+            self._gpio.set_high(self._cs)
         time.sleep(1.0)
         # Call GetFirmwareVersion to sync up with the PN532.  This might not be
         # required but is done in the Arduino library and kept for consistency.
         self.get_firmware_version()
-        self._gpio.set_high(self._cs)
+
+    def wakeup(self):
+        """Wake the PN532 up from power down.  Over SPI the chip wakes as soon
+        as the CS line is asserted, it then needs a couple of milliseconds for
+        its oscillator to settle before it will accept a command.  Unlike
+        begin() this keeps the SAM configuration and does not re-sync.
+        """
+        with self._bus_lock:
+            self._gpio.set_low(self._cs)
+            self._sleep_ms(2)
+            self._gpio.set_high(self._cs)
 
     def get_firmware_version(self):
         """Call PN532 GetFirmwareVersion function and return a tuple with the IC,
@@ -361,25 +663,69 @@ class PN532(object):
         # check the command was executed as expected.
         self.call_function(PN532_COMMAND_SAMCONFIGURATION, params=[0x01, 0x14, 0x01])
 
-    def read_passive_target(self, card_baud=PN532_MIFARE_ISO14443A, timeout_sec=1):
-        """Wait for a MiFare card to be available and return its UID when found.
+    def rf_configuration(self, cfg_item, config_data):
+        """Send an RFConfiguration command with the specified configuration
+        item and its data bytes.  Returns True if the PN532 accepted it.
+        """
+        response = self.call_function(PN532_COMMAND_RFCONFIGURATION,
+                                      params=[cfg_item] + list(config_data))
+        return response is not None
+
+    def set_passive_activation_retries(self, retries, atr_retries=0xFF, psl_retries=0x01):
+        """Set how many times the PN532 retries activating a passive target
+        for InListPassiveTarget (0xFF retries until a card is found, 0x00 tries
+        once), and the ATR_REQ and PSL_REQ retries.  Retries run on the PN532
+        itself, so a card is found as soon as it enters the RF field.
+        """
+        return self.rf_configuration(PN532_CFGITEM_MAX_RETRIES,
+                                     [atr_retries & 0xFF, psl_retries & 0xFF, retries & 0xFF])
+
+    def set_timeouts(self, atr_timeout, retry_timeout):
+        """Set the ATR_RES timeout and the timeout of InCommunicateThru as
+        PN532 timeout codes, 0x01 is 100us and every step doubles it up to
+        0x10 for 3.28 seconds.
+        """
+        return self.rf_configuration(PN532_CFGITEM_TIMINGS,
+                                     [0x00, atr_timeout & 0xFF, retry_timeout & 0xFF])
+
+    def list_passive_target(self, card_baud=PN532_MIFARE_ISO14443A, timeout_sec=1):
+        """Wait for a MiFare card to be available and return its target data.
         Will wait up to timeout_sec seconds and return None if no card is found,
-        otherwise a bytearray with the UID of the found card is returned.
+        otherwise a tuple of the ATQA (as an int), the SAK and a bytearray with
+        the UID of the found card is returned.  The ATQA and SAK identify the
+        card family, e.g. SAK 0x08 for MiFare Classic 1K and 0x00 for MiFare
+        Ultralight and NTAG2xx.
         """
         # Send passive read command for 1 card.  Expect at most a 7 byte UUID.
         response = self.call_function(PN532_COMMAND_INLISTPASSIVETARGET,
                                       params=[0x01, card_baud],
-                                      response_length=17)
+                                      response_length=17,
+                                      timeout_sec=timeout_sec)
         # If no response is available return None to indicate no card is present.
         if response is None:
             return None
+        # No card answered within the passive activation retries.
+        if response[0] == 0x00:
+            return None
         # Check only 1 card with up to a 7 byte UID is present.
         if response[0] != 0x01:
             raise RuntimeError('More than one card detected!')
         if response[5] > 7:
             raise RuntimeError('Found card with unexpectedly long UID!')
+        # Return ATQA, SAK and UID of card.
+        atqa = (response[2] << 8) | response[3]
+        return atqa, response[4], response[6:6+response[5]]
+
+    def read_passive_target(self, card_baud=PN532_MIFARE_ISO14443A, timeout_sec=1):
+        """Wait for a MiFare card to be available and return its UID when found.
+        Will wait up to timeout_sec seconds and return None if no card is found,
+        otherwise a bytearray with the UID of the found card is returned.
+        """
+        target = self.list_passive_target(card_baud, timeout_sec)
+        if target is None:
+            return None
         # Return UID of card.
-        return response[6:6+response[5]]
+        return target[2]
 
     def mifare_classic_authenticate_block(self, uid, block_number, key_number, key):
         """Authenticate specified block number for a MiFare classic card.  Uid
@@ -402,7 +748,7 @@ class PN532(object):
         response = self.call_function(PN532_COMMAND_INDATAEXCHANGE,
                                       params=params,
                                       response_length=1)
-        return response[0] == 0x00
+        return response is not None and response[0] == 0x00
 
     def mifare_classic_read_block(self, block_number):
         """Read a block of data from the card.  Block number should be the block
@@ -415,7 +761,7 @@ class PN532(object):
                                       params=[0x01, MIFARE_CMD_READ, block_number & 0xFF],
                                       response_length=17)
         # Check first response is 0x00 to show success.
-        if response[0] != 0x00:
+        if response is None or response[0] != 0x00:
             return None
         # Return first 4 bytes since 16 bytes are always returned.
         return response[1:]
@@ -437,38 +783,64 @@ class PN532(object):
         response = self.call_function(PN532_COMMAND_INDATAEXCHANGE,
                                       params=params,
                                       response_length=1)
-        return response[0] == 0x00
+        return response is not None and response[0] == 0x00
 
-    def ntag2xx_read_page(self, page):
-        # data is read in 16 byte blocks, so we need to find the block and section 
-        # of the page we want to read
-        parser = ((float(page) * 4.0) / 16.0)
-        parser = str(parser).split('.', 1)
-
-        # parser[0] is the block and parser[1] is the byteIndex
-        block = int(parser[0])
-        byteIndex = 0
-        if parser[1] == '0':
-            byteIndex = 0
-        elif parser[1] == '25':
-            byteIndex = 4
-        elif parser[1] == '5':
-            byteIndex = 8
-        elif parser[1] == '75':
-            byteIndex = 12
-
-        #print ("page number " + str(page) + " is found at: block " + str(block) + " byte: " + str(byteIndex))
-
-        # Send InDataExchange request to read page of ntag2xx data.
-        # Read data in 16 byte blocks
+    def ntag2xx_read_block(self, page):
+        """Read four pages of a ntag2xx starting at the specified page.  The tag
+        always answers a READ with 16 bytes, so a bytearray of length 16 is
+        returned, or None if the pages could not be read.  Reads past the end
+        of the tag memory roll over to page 0.
+        """
+        # Send InDataExchange request to read 4 pages of ntag2xx data.
         response = self.call_function(PN532_COMMAND_INDATAEXCHANGE,
-                                       params=[0x01, MIFARE_CMD_READ, page & 0xFF],
-                                       response_length=16)
+                                      params=[0x01, MIFARE_CMD_READ, page & 0xFF],
+                                      response_length=17)
         # Check response is 0x00 to show success.
-        if response[0] != 0x00:
+        if response is None or response[0] != 0x00:
+            return None
+        return response[1:17]
+
+    def ntag2xx_read_page(self, page):
+        """Read a single 4 byte page of a ntag2xx, returns a bytearray of length
+        4 or None if the page could not be read.
+        """
+        block = self.ntag2xx_read_block(page)
+        if block is None:
             return None
-        return response[1:5]
-        #return response[6:9]
+        return block[0:4]
+
+    def ntag2xx_get_version(self):
+        """Send the NTAG2xx GET_VERSION command and return the 8 byte version
+        information (vendor, product type, subtype, major and minor version,
+        storage size and protocol type), or None if the tag does not support
+        it.  MiFare Ultralight tags without GET_VERSION stop responding and have
+        to be selected again with read_passive_target.
+        """
+        # GET_VERSION is not an InDataExchange command of the PN532, send it
+        # to the tag directly.
+        response = self.call_function(PN532_COMMAND_INCOMMUNICATETHRU,
+                                      params=[NTAG2XX_CMD_GET_VERSION],
+                                      response_length=9)
+        if response is None or response[0] != 0x00 or len(response) < 9:
+            return None
+        return response[1:9]
+
+    def ntag2xx_fast_read(self, start_page, end_page):
+        """Read the pages from start_page to end_page (inclusive) with a single
+        NTAG21x FAST_READ.  At most NTAG2XX_FAST_READ_MAX_PAGES pages fit in one
+        response frame.  Returns a bytearray with 4 bytes per page, or None if
+        the tag did not answer (plain MiFare Ultralights do not know FAST_READ
+        and need to be selected again afterwards).
+        """
+        count = end_page - start_page + 1
+        assert 0 < count <= NTAG2XX_FAST_READ_MAX_PAGES, 'Page range must be 1 to {0} pages!'.format(NTAG2XX_FAST_READ_MAX_PAGES)
+        response = self.call_function(PN532_COMMAND_INDATAEXCHANGE,
+                                      params=[0x01, NTAG2XX_CMD_FAST_READ, start_page & 0xFF, end_page & 0xFF],
+                                      response_length=1+count*4)
+        # Check response is 0x00 and all pages are there to show success.
+        if response is None or response[0] != 0x00 or len(response) != 1+count*4:
+            return None
+        return response[1:]
 
     def ntag2xx_write_page(self, page, data):
         assert data is not None and len(data) == 4, 'Data must be an array of 4 bytes!'
@@ -482,7 +854,7 @@ class PN532(object):
         response = self.call_function(PN532_COMMAND_INDATAEXCHANGE,
                                       params=params,
                                       response_length=1)
-        return response[0] == 0x00
+        return response is not None and response[0] == 0x00
 
     def shutdown(self):
         # Send shutdown command
@@ -490,7 +862,7 @@ class PN532(object):
                             params=[PN532_WAKEUP_SPI, 0x01],
                             response_length=17)
         # Check response is 0x00 to show success.
-        if response[0] != 0x00:
+        if response is None or response[0] != 0x00:
             print('error occured shutting down nfc')
             return None            
         return response
\ No newline at end of file
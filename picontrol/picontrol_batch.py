@@ -0,0 +1,102 @@
+import time, threading
+import picontrol_nfc as nfc
+
+# batch tag programming. A queue of games is written to the tags presented to
+# the reader one after another: as soon as a tag that was not programmed in
+# this batch shows up, the next game is written to it with a verified write.
+# A tag that fails keeps its game at the head of the queue, the next tag or
+# the same tag once it was taken away and tapped again retries it.
+class BatchProgrammer(threading.Thread):
+    def __init__(self, entries, slot=0, interval=0.1, scanTimeout=0.2):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.slot = slot
+        self.interval = interval
+        self.scanTimeout = scanTimeout
+        self.lock = threading.Lock()
+        # [{'console', 'rom'}] still to be written
+        self.pending = [{'console': entry['console'], 'rom': entry['rom']} for entry in entries]
+        # one result per tag written or failed, a retry updates the tag's result
+        self.results = []
+        self.resultByUid = {}
+        # uids written in this batch, they are skipped while they stay in the field
+        self.programmed = set()
+        # uids that failed, skipped until the field is empty again
+        self.failed = set()
+        self.startedAt = None
+        self.stopEvent = threading.Event()
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def run(self):
+        self.startedAt = time.time()
+        while self.pending and not self.stopEvent.is_set():
+            try:
+                self.poll()
+            except:
+                pass
+            self.stopEvent.wait(self.interval)
+
+    def poll(self):
+        uid = nfc.scan(self.scanTimeout, self.slot)
+        if uid is None:
+            # the failed tags were taken away, tapping one again retries it
+            self.failed.clear()
+            return
+        if nfc.uidKey(uid) in self.programmed or nfc.uidKey(uid) in self.failed:
+            return
+
+        entry = self.pending[0]
+        message = nfc.createGameMessage(entry['console'], entry['rom'])
+
+        startedAt = time.time()
+        resp = nfc.write(message, slot=self.slot, verify=True)
+        result = {'console': entry['console'], 'rom': entry['rom'], 'uid': nfc.uidKey(uid),
+                  'type': resp.type, 'message': resp.message, 'seconds': round(time.time() - startedAt, 3)}
+        with self.lock:
+            if resp.type == 'success':
+                # the tag that was really written, it may have been swapped
+                result['uid'] = resp.data
+                self.programmed.add(resp.data)
+                self.pending.pop(0)
+            else:
+                self.failed.add(result['uid'])
+            previous = self.resultByUid.get(result['uid'])
+            if previous is not None:
+                result['attempts'] = previous['attempts'] + 1
+                previous.update(result)
+            else:
+                result['attempts'] = 1
+                self.resultByUid[result['uid']] = result
+                self.results.append(result)
+
+    def status(self):
+        with self.lock:
+            written = len([result for result in self.results if result['type'] == 'success'])
+            return {'running': bool(self.pending) and self.is_alive() and not self.stopEvent.is_set(),
+                    'slot': self.slot,
+                    'pending': list(self.pending),
+                    'results': [dict(result) for result in self.results],
+                    'written': written,
+                    'failed': len(self.results) - written,
+                    'seconds': round(time.time() - self.startedAt, 3) if self.startedAt else 0}
+
+batch = None
+
+def start(entries, slot=0):
+    # a new batch replaces a running one
+    global batch
+    stop()
+    batch = BatchProgrammer(entries, slot)
+    batch.start()
+    return batch
+
+def stop():
+    if batch is not None:
+        batch.stop()
+
+def status():
+    if batch is None:
+        return None
+    return batch.status()
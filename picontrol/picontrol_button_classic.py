@@ -2,7 +2,7 @@ import sys, os, time, json, subprocess
 import RPi.GPIO as GPIO
 import picontrol_processes as procs
 import picontrol_nfc as nfc
-import picontrol_ndef as ndef
+import picontrol_monitor as monitor
 
 #setup GPIO
 gpioPower = 3
@@ -18,6 +18,9 @@ GPIO.setup(gpioReset, GPIO.IN, GPIO.PUD_UP)
 GPIO.setup(gpioLed, GPIO.OUT)
 GPIO.output(gpioLed,1)
 
+#watch the nfc reader for tags if enabled
+tagMonitor = monitor.startMonitor()
+
 shutDownCounter = 0
 
 #loop the button controls
@@ -28,15 +31,14 @@ while True:
             gameData = {'console':'', 'rom':''}
             if GPIO.input(gpioPower) == False:
                 # try to load the nfc tag
-                response = nfc.read()
+                response = tagMonitor.read() if tagMonitor else nfc.read()
 
                 if response.type == 'success':
                     #we have a cart in the console
-                    message = response.data
+                    game = nfc.gameFromMessage(response.data)
                     
-                    if (len(message.records) > 0):
-                        gameData['console'] = message.records[0].value
-                        gameData['rom'] = message.records[1].value
+                    if game is not None:
+                        gameData['console'], gameData['rom'] = game
 
                     #start game
                     procs.runGame(gameData['console'], gameData['rom'], 'nfc')
@@ -49,14 +51,7 @@ while True:
             GPIO.output(gpioLed,0)
 
             # we hit the power button, kill running game or es
-            procnames = ["retroarch", "ags", "uae4all2", "uae4arm", "capricerpi", "linapple", "hatari", "stella",
-                    "atari800", "xroar", "vice", "daphne", "reicast", "pifba", "osmose", "gpsp", "jzintv",
-                    "basiliskll", "mame", "advmame", "dgen", "openmsx", "mupen64plus", "gngeo", "dosbox", "ppsspp",
-                    "simcoupe", "scummvm", "snes9x", "pisnes", "frotz", "fbzx", "fuse", "gemrb", "cgenesis", "zdoom",
-                    "eduke32", "lincity", "love", "alephone", "micropolis", "openbor", "openttd", "opentyrian",
-                    "cannonball", "tyrquake", "ioquake3", "residualvm", "xrick", "sdlpop", "uqm", "stratagus",
-                    "wolf4sdl", "solarus", "emulationstation"]
-            procs.killTasks(procnames)
+            procs.stopGame()
 
             shutDownCounter += 1
 
@@ -123,9 +118,7 @@ while True:
                     time.sleep(0.5)
                     GPIO.output(gpioLed,1)
 
-                    message = ndef.Message()
-                    message.addTextRecord(gameData['console'])
-                    message.addTextRecord(gameData['rom'])
+                    message = nfc.createGameMessage(gameData['console'], gameData['rom'])
 
                     response = nfc.write(message)
                 else:
@@ -134,13 +127,13 @@ while True:
                     GPIO.output(gpioLed,1)
                     
                     # try reading from nfc first...
-                    response = nfc.read()
+                    response = tagMonitor.read() if tagMonitor else nfc.read()
 
                     if response.type == 'success':
                         #we have a cart in the console
-                        message = response.data
-                        gameData['console'] = message.records[0].value
-                        gameData['rom'] = message.records[1].value
+                        game = nfc.gameFromMessage(response.data)
+                        if game is not None:
+                            gameData['console'], gameData['rom'] = game
 
                     
                     if gameData['console'] != '':
@@ -2,7 +2,7 @@ import sys, os, time, json, subprocess
 import RPi.GPIO as GPIO
 import picontrol_processes as procs
 import picontrol_nfc as nfc
-import picontrol_ndef as ndef
+import picontrol_monitor as monitor
 
 #setup GPIO
 gpioPower = 3
@@ -18,6 +18,9 @@ GPIO.setup(gpioReset, GPIO.IN, GPIO.PUD_UP)
 GPIO.setup(gpioLed, GPIO.OUT)
 GPIO.output(gpioLed,1)
 
+#watch the nfc reader for tags if enabled
+tagMonitor = monitor.startMonitor()
+
 #loop the button controls
 while True:
     try:
@@ -61,9 +64,7 @@ while True:
                 time.sleep(.5)
                 GPIO.output(gpioLed,1)
 
-                message = ndef.Message()
-                message.addTextRecord(gameData['console'])
-                message.addTextRecord(gameData['rom'])
+                message = nfc.createGameMessage(gameData['console'], gameData['rom'])
 
                 response = nfc.write(message)
             else:
@@ -73,15 +74,14 @@ while True:
                 GPIO.output(gpioLed,1)
                 
                 # try reading from nfc first...
-                response = nfc.read()
+                response = tagMonitor.read() if tagMonitor else nfc.read()
 
                 if response.type == 'success':
                     #we have a cart in the console
-                    message = response.data
+                    game = nfc.gameFromMessage(response.data)
 
-                    if (len(message.records) > 0):
-                        gameData['console'] = message.records[0].value
-                        gameData['rom'] = message.records[1].value
+                    if game is not None:
+                        gameData['console'], gameData['rom'] = game
 
                 
                 if gameData['console'] != '':
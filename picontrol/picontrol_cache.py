@@ -0,0 +1,81 @@
+import os, json, threading
+from collections import OrderedDict
+
+configPath = '/home/pi/scripts/picontrol/configs'
+
+# small persistent key/value store kept as a json file in the configs folder.
+# The button scripts and the webserver run in separate processes, so the file
+# is read again whenever another process has changed it. With maxEntries the
+# entries set longest ago are dropped once there are more of them.
+class JsonCache(object):
+    def __init__(self, filename, maxEntries=None):
+        self.path = os.path.join(configPath, filename)
+        self.maxEntries = maxEntries
+        self.lock = threading.RLock()
+        # in the order the keys were set, oldest first
+        self.entries = OrderedDict()
+        self.version = None
+
+    def fileVersion(self):
+        # every save renames a new file into place, so the inode changes too
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_ino, stat.st_mtime)
+        except OSError:
+            return None
+
+    def load(self):
+        with self.lock:
+            version = self.fileVersion()
+            if version != self.version:
+                self.version = version
+                self.entries = OrderedDict()
+                if version is not None:
+                    try:
+                        with open(self.path) as f:
+                            self.entries = json.load(f, object_pairs_hook=OrderedDict)
+                    except (IOError, ValueError):
+                        pass
+            return self.entries
+
+    def save(self):
+        # write a temp file and rename it so readers never see half a file
+        with self.lock:
+            tmpPath = '{0}.{1}.tmp'.format(self.path, os.getpid())
+            try:
+                with open(tmpPath, 'w') as f:
+                    # not sorted, the file keeps the order for the cap
+                    json.dump(self.entries, f)
+                os.rename(tmpPath, self.path)
+                self.version = self.fileVersion()
+            except (IOError, OSError):
+                pass
+
+    def get(self, key, default=None):
+        return self.load().get(key, default)
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, values):
+        # set several keys with one write of the file
+        with self.lock:
+            entries = self.load()
+            changed = False
+            for key, value in values.items():
+                if entries.get(key) != value:
+                    entries.pop(key, None)
+                    entries[key] = value
+                    changed = True
+            if changed:
+                if self.maxEntries is not None:
+                    while len(entries) > self.maxEntries:
+                        entries.popitem(last=False)
+                self.save()
+
+    def delete(self, key):
+        with self.lock:
+            entries = self.load()
+            if key in entries:
+                del entries[key]
+                self.save()
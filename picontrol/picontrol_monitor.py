@@ -0,0 +1,184 @@
+import os, errno, json, time, threading
+import picontrol_nfc as nfc
+
+statePath = '/dev/shm/picontrol_tag.json'
+
+def getStatePath(slot=0):
+    if slot == 0:
+        return statePath
+    return '/dev/shm/picontrol_tag.{0}.json'.format(slot)
+
+# background tag presence monitor of one slot. Every interval seconds it looks
+# for a tag with one short InListPassiveTarget, reads a newly inserted tag once
+# and calls its subscribers with ('inserted', uid, message) or ('removed', uid,
+# None). The current tag is published to the slot's state file for the other
+# picontrol processes unless publish is False.
+class TagMonitor(threading.Thread):
+    def __init__(self, interval=0.5, scanTimeout=0.2, maxMisses=2, slot=0, publish=True):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.slot = slot
+        # a foreground watcher must not replace the resident monitor's state
+        self.publish = publish
+        self.interval = interval
+        self.scanTimeout = scanTimeout
+        # scans a tag may miss before it counts as removed
+        self.maxMisses = maxMisses
+        self.subscribers = []
+        self.uid = None
+        self.message = None
+        self.insertedAt = None
+        self.misses = 0
+        self.stopEvent = threading.Event()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def run(self):
+        if self.publish:
+            publish(None, None, self.slot)
+        while not self.stopEvent.is_set():
+            try:
+                self.poll()
+            except:
+                pass
+            self.stopEvent.wait(self.interval)
+        if self.publish:
+            publish(None, None, self.slot)
+
+    def poll(self):
+        uid = nfc.scan(self.scanTimeout, self.slot)
+        if uid is None:
+            if self.uid is not None:
+                self.misses += 1
+                if self.misses >= self.maxMisses:
+                    self.changed('removed', self.uid, None)
+            return
+
+        self.misses = 0
+        if self.uid is not None and uid != self.uid:
+            # another tag took the place of the current one between two scans
+            self.changed('removed', self.uid, None)
+        if uid != self.uid or self.isStale():
+            resp = nfc.read(False, self.slot)
+            if resp.type == 'success':
+                self.changed('inserted', uid, resp.data)
+
+    def isStale(self):
+        # the tag was written since we read it if its registry entry changed
+        entry = nfc.registry.get(nfc.uidKey(self.uid))
+        game = nfc.gameFromMessage(self.message)
+        if entry is None or game is None:
+            return False
+        return (entry['console'], entry['rom']) != game
+
+    def changed(self, event, uid, message):
+        self.misses = 0
+        if event == 'removed':
+            self.uid = None
+            self.message = None
+            self.insertedAt = None
+        else:
+            if uid != self.uid:
+                self.insertedAt = time.time()
+            self.uid = uid
+            self.message = message
+        if self.publish:
+            publish(self.uid, self.message, self.slot, self.insertedAt)
+        for callback in self.subscribers:
+            try:
+                callback(event, uid, message)
+            except:
+                pass
+
+    def read(self):
+        # the decoded tag if one is in the console, else a regular read
+        message = self.message
+        if message is None:
+            return nfc.read(slot=self.slot)
+        resp = nfc.response()
+        resp.type = 'success'
+        resp.message = 'success'
+        resp.data = message
+        return resp
+
+# the monitors of all slots, the button scripts launch the game of the tag that
+# was inserted last
+class SlotMonitors(object):
+    def __init__(self, monitors):
+        self.monitors = monitors
+
+    def start(self):
+        for monitor in self.monitors:
+            monitor.start()
+
+    def stop(self):
+        for monitor in self.monitors:
+            monitor.stop()
+
+    def subscribe(self, callback):
+        # callback(event, uid, message) of every slot
+        for monitor in self.monitors:
+            monitor.subscribe(callback)
+
+    def latest(self):
+        # the monitor of the most recently inserted tag, the first slot if
+        # there is no tag in any slot
+        latest = self.monitors[0]
+        for monitor in self.monitors:
+            if monitor.insertedAt is not None and (latest.insertedAt is None or monitor.insertedAt > latest.insertedAt):
+                latest = monitor
+        return latest
+
+    def read(self, slot=None):
+        if slot is None:
+            return self.latest().read()
+        return self.monitors[slot].read()
+
+def startMonitor():
+    # resident monitors for the button scripts, [nfc] monitor = 1 enables them
+    if nfc.getSetting("monitor", "0") != "1":
+        return None
+    interval = float(nfc.getSetting("monitorinterval", 0.5))
+    monitors = SlotMonitors([TagMonitor(interval, slot=slot) for slot in nfc.getSlots()])
+    monitors.start()
+    return monitors
+
+def publish(uid, message, slot=0, insertedAt=None):
+    state = {'pid': os.getpid(), 'slot': slot, 'uid': None, 'records': [], 'inserted': None}
+    if uid is not None:
+        state['uid'] = nfc.uidKey(uid)
+        # console and rom, whichever format the tag has
+        game = nfc.gameFromMessage(message)
+        state['records'] = list(game) if game is not None else []
+        state['inserted'] = insertedAt
+    path = getStatePath(slot)
+    tmpPath = path + '.tmp'
+    try:
+        with open(tmpPath, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmpPath, path)
+    except (IOError, OSError):
+        pass
+
+def readStates():
+    # the published state of every slot, None for a slot without a monitor
+    return [readState(slot) for slot in nfc.getSlots()]
+
+def readState(slot=0):
+    # the state published by a running monitor, None if there is no monitor
+    try:
+        with open(getStatePath(slot)) as f:
+            state = json.load(f)
+        os.kill(state['pid'], 0)
+        return state
+    except OSError as e:
+        # the monitor runs as another user
+        if e.errno == errno.EPERM:
+            return state
+        return None
+    except (IOError, ValueError, KeyError):
+        return None
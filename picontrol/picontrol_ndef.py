@@ -1,9 +1,10 @@
-import json
+import json, binascii
 
 #NDEF Record Format
 
 # Prefixes for NDEF Records (to identify record type)
 NDEF_WELLKNOWNRECORD                = 0x1
+NDEF_EXTERNALRECORD                 = 0x4
 
 NDEF_RECORDTYPE_TEXT                = 0x54
 NDEF_RECORDTYPE_URI                 = 0x55
@@ -48,8 +49,217 @@ NDEF_URIPREFIX_URN_EPC_RAW          = 0x21
 NDEF_URIPREFIX_URN_EPC              = 0x22
 NDEF_URIPREFIX_URN_NFC              = 0x23
 
+# TLV blocks in the data area of a tag
+TLV_NULL                            = 0x00
+TLV_LOCK_CONTROL                    = 0x01
+TLV_MEMORY_CONTROL                  = 0x02
+TLV_NDEF                            = 0x03
+TLV_PROPRIETARY                     = 0xFD
+TLV_TERMINATOR                      = 0xFE
+
+# Record header flags, the low 3 bits are the TNF (type name format)
+NDEF_FLAG_MB                        = 0x80 # message begin
+NDEF_FLAG_ME                        = 0x40 # message end
+NDEF_FLAG_CF                        = 0x20 # chunked record
+NDEF_FLAG_SR                        = 0x10 # short record, 1 byte payload length
+NDEF_FLAG_IL                        = 0x08 # id length present
+NDEF_TNF_MASK                       = 0x07
+NDEF_TNF_UNCHANGED                  = 0x06
+
+# Status byte of a text record
+NDEF_TEXT_UTF16                     = 0x80
+NDEF_TEXT_LANGUAGE_MASK             = 0x3F
+
+def toBytes(value):
+    # bytes of a record field, text is utf-8 encoded
+    if isinstance(value, bytearray):
+        return value
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return bytearray(value)
+
+def toText(data, encoding='utf-8'):
+    # str of a memoryview slice, on python 2 that is the utf-8 bytes like the
+    # values that are written
+    text = data.tobytes()
+    if str is bytes:
+        if encoding != 'utf-8':
+            text = text.decode(encoding).encode('utf-8')
+        return text
+    return text.decode(encoding, 'replace')
+
+def toJSON(data):
+    # compact JSON of toDict() results
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+def findTLV(buffer, tlvType=TLV_NDEF, offset=0):
+    # (start, length) of the value of the first tlvType TLV in buffer, None if
+    # there is none or it is cut off. The length is None when the buffer ends
+    # inside the length field
+    end = len(buffer)
+    while offset < end:
+        tag = buffer[offset]
+        if tag == TLV_NULL:
+            offset += 1
+            continue
+        if tag == TLV_TERMINATOR:
+            return None
+        if offset + 1 >= end:
+            return (offset + 1, None) if tag == tlvType else None
+        length = buffer[offset + 1]
+        start = offset + 2
+        if length == 0xFF:
+            # 3 byte format, 0xFF and a 2 byte length
+            if offset + 3 >= end:
+                return (offset + 1, None) if tag == tlvType else None
+            length = (buffer[offset + 2] << 8) | buffer[offset + 3]
+            start = offset + 4
+        if tag == tlvType:
+            return start, length
+        offset = start + length
+    return None
+
+def parseRecords(buffer, start=0, end=None):
+    # records of the NDEF message in buffer[start:end], walked by the lengths
+    # in the record headers. Payloads are sliced from a memoryview, chunked
+    # records are joined into one record
+    if not isinstance(buffer, bytearray):
+        buffer = bytearray(buffer)
+    if end is None:
+        end = len(buffer)
+    view = memoryview(buffer)
+    records = []
+    chunks = None
+    offset = start
+    while offset < end:
+        flags = buffer[offset]
+        if offset + 2 >= end:
+            break
+        typeLength = buffer[offset + 1]
+        offset += 2
+        if flags & NDEF_FLAG_SR:
+            payloadLength = buffer[offset]
+            offset += 1
+        else:
+            if offset + 4 > end:
+                break
+            payloadLength = (buffer[offset] << 24) | (buffer[offset + 1] << 16) | (buffer[offset + 2] << 8) | buffer[offset + 3]
+            offset += 4
+        idLength = 0
+        if flags & NDEF_FLAG_IL:
+            if offset >= end:
+                break
+            idLength = buffer[offset]
+            offset += 1
+        recordType = view[offset:offset + typeLength]
+        offset += typeLength + idLength
+        payload = view[offset:offset + payloadLength]
+        offset += payloadLength
+        if offset > end:
+            # cut off record
+            break
+
+        if flags & NDEF_FLAG_CF:
+            # first or middle chunk, the type comes with the first one
+            if chunks is None:
+                chunks = (flags & NDEF_TNF_MASK, recordType.tobytes(), bytearray())
+            chunks[2].extend(payload)
+        elif chunks is not None:
+            # last chunk
+            chunks[2].extend(payload)
+            records.append(createRecord(chunks[0], chunks[1], memoryview(chunks[2])))
+            chunks = None
+        else:
+            records.append(createRecord(flags & NDEF_TNF_MASK, recordType.tobytes(), payload))
+
+        if flags & NDEF_FLAG_ME:
+            break
+    return records
+
+def createRecord(tnf, recordType, payload):
+    # Record of a parsed record, payload is a memoryview
+    record = Record()
+    record.ndefType = tnf
+    record.recordType = bytearray(recordType)[0] if len(recordType) == 1 else toText(memoryview(recordType))
+    if tnf == NDEF_WELLKNOWNRECORD and record.recordType == NDEF_RECORDTYPE_TEXT and len(payload) > 0:
+        status = bytearray(payload[0:1])[0]
+        languageLength = status & NDEF_TEXT_LANGUAGE_MASK
+        record.definition = status
+        record.language = toText(payload[1:1 + languageLength])
+        record.value = toText(payload[1 + languageLength:], 'utf-16' if status & NDEF_TEXT_UTF16 else 'utf-8')
+    elif tnf == NDEF_WELLKNOWNRECORD and record.recordType == NDEF_RECORDTYPE_URI and len(payload) > 0:
+        record.definition = bytearray(payload[0:1])[0]
+        record.value = toText(payload[1:])
+    elif tnf == NDEF_EXTERNALRECORD:
+        # application data, kept as bytes
+        record.definition = None
+        record.language = ''
+        record.value = payload.tobytes()
+    else:
+        record.definition = None
+        record.language = ''
+        record.value = toText(payload)
+    return record
+
+
+# incremental decoder of the data area of a tag. feed() takes the bytes as they
+# are read from the tag and returns how many more bytes the NDEF TLV needs, 0
+# once the message is complete or the data area has no message
+class MessageDecoder(object):
+    # zero bytes in a row where a TLV should start that are taken for an
+    # unused data area rather than NULL TLV padding
+    MAX_PADDING = 16
+
+    def __init__(self):
+        self.buffer = bytearray()
 
+    def feed(self, data):
+        self.buffer += data
+        return self.needed()
+
+    def needed(self):
+        buffer = self.buffer
+        end = len(buffer)
+        offset = 0
+        padding = 0
+        while True:
+            if offset >= end:
+                return offset - end + 1
+            tag = buffer[offset]
+            if tag == TLV_NULL:
+                padding += 1
+                if padding >= self.MAX_PADDING:
+                    return 0
+                offset += 1
+                continue
+            if tag == TLV_TERMINATOR:
+                return 0
+            padding = 0
+            if offset + 1 >= end:
+                return offset + 2 - end
+            length = buffer[offset + 1]
+            start = offset + 2
+            if length == 0xFF:
+                if offset + 3 >= end:
+                    return offset + 4 - end
+                length = (buffer[offset + 2] << 8) | buffer[offset + 3]
+                start = offset + 4
+            if tag == TLV_NDEF:
+                return max(0, start + length - end)
+            offset = start + length
+
+    def message(self):
+        # the decoded Message of the bytes fed so far
+        message = Message()
+        message.setBuffer(self.buffer)
+        message.decode()
+        return message
+
+# records and messages are created for every tag event, __slots__ keeps them
+# small. toDict() is what goes out as JSON
 class Record(object):
+    __slots__ = ('ndefType', 'recordType', 'definition', 'language', 'value')
+
     def __init__(self):
         # defaults
         self.ndefType = NDEF_WELLKNOWNRECORD
@@ -58,9 +268,16 @@ class Record(object):
         self.language = "en"
         self.value = ""
 
+    def toDict(self):
+        value = self.value
+        if self.ndefType == NDEF_EXTERNALRECORD:
+            # binary payload
+            value = binascii.hexlify(bytearray(value)).decode('ascii')
+        return {'ndefType': self.ndefType, 'recordType': self.recordType, 'definition': self.definition,
+                'language': self.language, 'value': value}
+
     def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__, 
-            sort_keys=True, indent=4)        
+        return toJSON(self.toDict())
 
     def setValue(self, value):
         self.value = value
@@ -93,13 +310,18 @@ class Record(object):
         return self.language
 
 class Message(object):
+    __slots__ = ('records', 'buffer')
+
     def __init__(self):
         self.records = []
         self.buffer = bytearray()
 
+    def toDict(self):
+        # the records, the raw buffer is left out
+        return {'records': [record.toDict() for record in self.records]}
+
     def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__, 
-            sort_keys=True, indent=4)
+        return toJSON(self.toDict())
 
     def setRecords(self, records):
         self.records = records
@@ -145,6 +367,17 @@ class Message(object):
         # Return the new record
         return self.records[len(self.records) - 1]
 
+    def addExternalRecord(self, recordType, value):
+        # external type record ("domain:type") with a binary payload
+        record = Record()
+        record.ndefType = NDEF_EXTERNALRECORD
+        record.recordType = recordType
+        record.definition = None
+        record.language = ''
+        record.value = value
+        self.records.append(record)
+        return record
+
     def addRecord(self, ndefType, recordType, definition, language, value):
         # Initialize record
         record = Record()
@@ -153,7 +386,8 @@ class Message(object):
         if (recordType != NDEF_RECORDTYPE_TEXT and recordType != NDEF_RECORDTYPE_URI):
             print('You can only add Text or URI records')
             return None
-        record.type = type
+        record.ndefType = ndefType
+        record.recordType = recordType
 
         # Add record definition
         record.definition = definition
@@ -175,79 +409,59 @@ class Message(object):
         del self.records[index]
 
     def encode(self):
-        # calc payloadLength
-        payloadLength = 0
+        # NDEF TLV with the records and a terminator TLV
         records = self.getRecords()
-        recordCount = len(records)
-
-        for i in range(recordCount):
-            payloadLength += len(records[i].value) + 7
-        
-        buffer = bytearray(payloadLength + 3)
-        buffer[0] = 0x03 # Indicates NDEF Record
-        buffer[1] = payloadLength
-        buffer[2] = 0xd1 # no chunks
-        if recordCount >= 2:
-            buffer[2] = 0x91 # has chunks
-
-        # loop through records and add to buffer
-        bufferIndex = 3
-        for i in range(recordCount):
-            buffer[bufferIndex] = records[i].ndefType
-            bufferIndex += 1
-            buffer[bufferIndex] = len(records[i].value) + 3
-            bufferIndex += 1
-            buffer[bufferIndex] = records[i].recordType
-            bufferIndex += 1
-            buffer[bufferIndex] = records[i].definition
-            bufferIndex += 1
-            buffer[bufferIndex] = records[i].language[:1]
-            bufferIndex += 1
-            buffer[bufferIndex] = records[i].language[1:]
-            bufferIndex +=1 
-
-            for r in range(len(records[i].value)):
-                buffer[bufferIndex] = str(records[i].value[r])
-                bufferIndex += 1
-
-            buffer[bufferIndex] = 0xfe # End NDEF Record
-            
-            if recordCount >= 2 and i <= recordCount - 3:
-                buffer[bufferIndex] = 0x11 # indicates start of next record 
-                bufferIndex += 1
-            
-            elif recordCount >= 2 and i <= recordCount - 2:
-                buffer[bufferIndex] = 0x51 # indicates start of last record 
-                bufferIndex += 1
+        message = bytearray()
+        for i in range(len(records)):
+            record = records[i]
+            recordType = record.recordType
+            if isinstance(recordType, int):
+                recordType = bytearray([recordType])
+            else:
+                recordType = toBytes(recordType)
+
+            if record.ndefType == NDEF_WELLKNOWNRECORD and record.recordType == NDEF_RECORDTYPE_TEXT:
+                # status byte with the language length, language, text
+                language = toBytes(record.language)
+                payload = bytearray([len(language) & NDEF_TEXT_LANGUAGE_MASK]) + language + toBytes(record.value)
+            elif record.ndefType == NDEF_WELLKNOWNRECORD and record.recordType == NDEF_RECORDTYPE_URI:
+                payload = bytearray([record.definition]) + toBytes(record.value)
+            else:
+                payload = toBytes(record.value)
+
+            flags = record.ndefType & NDEF_TNF_MASK
+            if i == 0:
+                flags |= NDEF_FLAG_MB
+            if i == len(records) - 1:
+                flags |= NDEF_FLAG_ME
+            if len(payload) <= 0xFF:
+                flags |= NDEF_FLAG_SR
+                header = bytearray([flags, len(recordType), len(payload)])
+            else:
+                length = len(payload)
+                header = bytearray([flags, len(recordType), (length >> 24) & 0xFF, (length >> 16) & 0xFF, (length >> 8) & 0xFF, length & 0xFF])
+            message += header + recordType + payload
+
+        if len(message) < 0xFF:
+            buffer = bytearray([TLV_NDEF, len(message)])
+        else:
+            buffer = bytearray([TLV_NDEF, 0xFF, (len(message) >> 8) & 0xFF, len(message) & 0xFF])
+        buffer += message
+        buffer.append(TLV_TERMINATOR)
 
         self.setBuffer(buffer)
 
         return self.getBuffer()
 
     def decode(self):
-        buffer = self.getBuffer()
+        # find the NDEF TLV and walk its records by their lengths
+        buffer = bytearray(self.getBuffer())
         records = []
 
-        ndef = buffer[0]
-        payloadLength = buffer[1]
-        chunker = buffer[2]
-
-        if ndef == 0x03: # we have a NDEF record
-            recordParser = []
-            for i in range(3,len(buffer)):
-                if buffer[i] == 0x11 or buffer[i] == 0x51 or buffer[i] == 0xfe: # we hit the end of a record
-                    record = Record()
-                    record.ndefType = recordParser[0]
-                    record.recordType = chr(recordParser[2])
-                    record.definition = recordParser[3]
-                    record.language = ''.join(chr(i) for i in recordParser[4:6])
-                    record.value = ''.join(chr(i) for i in recordParser[6:])
-                    records.append(record)
-                    recordParser = []
-                else:
-                    recordParser.append(buffer[i])
-                if buffer[i] == 0xfe: # this is the end of the message, exit loop
-                    break      
+        tlv = findTLV(buffer)
+        if tlv is not None and tlv[1] is not None:
+            start, length = tlv
+            records = parseRecords(buffer, start, min(len(buffer), start + length))
 
         self.setRecords(records)
         return self.getRecords()
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Round-trip fuzzing and throughput of the NDEF codec in picontrol_ndef.
+# Random and edge-case messages (long and non-ASCII names, names with the
+# bytes 0x11, 0x51 and 0xFE, many records, URI and external records) are
+# encoded, decoded again in one go and fed to MessageDecoder in random pieces,
+# every decoded message has to match the one that was encoded. Afterwards the
+# encode and decode throughput is measured. Prints JSON, exits with 1 if any
+# message did not round-trip.
+#
+#   python picontrol_ndef_bench.py
+#   python picontrol_ndef_bench.py --seed 7 --messages 5000 --seconds 2
+from __future__ import print_function
+import sys, time, json, random, argparse
+import picontrol_ndef as ndef
+
+# pieces names are made of, the byte values the old decoder split on included
+NAME_PARTS = [u'Super Mario World', u' (USA)', u' (Europe) (En,Fr,De)', u' [!]', u' & ', u'$', u'.sfc', u'.zip',
+              u'Pokémon', u'ポケモン', u'Füßball', u'þ', u'Ǿ', u'Q',
+              u'\x11', u'\x51', u'\x00', u'™', u'\U0001f3ae']
+LANGUAGES = ['en', 'de', 'ja', 'en-US', '']
+URI_PREFIXES = [ndef.NDEF_URIPREFIX_NONE, ndef.NDEF_URIPREFIX_HTTP_WWWDOT, ndef.NDEF_URIPREFIX_HTTPS,
+                ndef.NDEF_URIPREFIX_FILE, ndef.NDEF_URIPREFIX_URN_NFC]
+
+def toStr(text):
+    # the str the codec hands out, utf-8 bytes on python 2
+    if str is bytes:
+        return text.encode('utf-8')
+    return text
+
+def randomName(rng, length=None):
+    if length is None:
+        length = rng.choice([0, 1, 2, 5, 10, 40])
+    return u''.join(rng.choice(NAME_PARTS) for i in range(length))
+
+def randomMessage(rng):
+    message = ndef.Message()
+    for i in range(rng.choice([1, 1, 2, 2, 3, 8, 40])):
+        kind = rng.random()
+        if kind < 0.7:
+            message.addTextRecord(toStr(randomName(rng))).language = rng.choice(LANGUAGES)
+        elif kind < 0.9:
+            message.addUriRecord(rng.choice(URI_PREFIXES), toStr(randomName(rng)))
+        else:
+            payload = bytearray(rng.randrange(256) for i in range(rng.choice([0, 1, 5, 300])))
+            message.addExternalRecord('picontrol:fuzz', bytes(payload))
+    return message
+
+def edgeMessages():
+    # messages at the boundaries of the record and TLV length fields
+    messages = []
+    for length in [0, 1, 250, 251, 252, 253, 254, 255, 256, 1000]:
+        message = ndef.Message()
+        message.addTextRecord('x' * length)
+        messages.append(message)
+    for values in [['snes', 'Super Mario World (USA).sfc'], ['gba', 'Q\x11\x51.gba'], ['', ''],
+                   [toStr(u'þǾ'), toStr(u'\U0001f3ae')]]:
+        message = ndef.Message()
+        for value in values:
+            message.addTextRecord(value)
+        messages.append(message)
+    message = ndef.Message()
+    for i in range(255):
+        message.addTextRecord(str(i))
+    messages.append(message)
+    message = ndef.Message()
+    message.addExternalRecord('picontrol:fuzz', bytes(bytearray([0xFE, 0x11, 0x51, 0x03, 0x00] * 60)))
+    messages.append(message)
+    return messages
+
+def recordKey(record):
+    # what has to survive a round trip, the encoder writes the text status
+    # byte from the language so the text definition is not compared
+    if record.ndefType == ndef.NDEF_WELLKNOWNRECORD and record.recordType == ndef.NDEF_RECORDTYPE_TEXT:
+        return (record.ndefType, record.recordType, record.language, record.value)
+    if record.ndefType == ndef.NDEF_WELLKNOWNRECORD and record.recordType == ndef.NDEF_RECORDTYPE_URI:
+        return (record.ndefType, record.recordType, record.definition, record.value)
+    return (record.ndefType, record.recordType, bytes(bytearray(record.value)))
+
+def decode(buffer):
+    message = ndef.Message()
+    message.setBuffer(buffer)
+    message.decode()
+    return message
+
+def checkMessage(message, rng):
+    # list of the round trips message failed
+    failures = []
+    expected = [recordKey(record) for record in message.getRecords()]
+    buffer = bytearray(message.encode())
+
+    if [recordKey(record) for record in decode(buffer).getRecords()] != expected:
+        failures.append('decode')
+
+    # the data area of a tag: lock control TLV, message, unused memory
+    if [recordKey(record) for record in decode(bytearray([ndef.TLV_LOCK_CONTROL, 3, 0xA0, 0x10, 0x44]) + buffer + bytearray(16)).getRecords()] != expected:
+        failures.append('tlvs')
+
+    # fed in pieces like reads from a tag, the decoder has to stop exactly at
+    # the end of the message
+    decoder = ndef.MessageDecoder()
+    offset = 0
+    needed = 1
+    while needed > 0 and offset < len(buffer):
+        size = rng.choice([1, 4, 16, max(1, needed)])
+        needed = decoder.feed(buffer[offset:offset + size])
+        offset += size
+    if needed != 0 or [recordKey(record) for record in decoder.message().getRecords()] != expected:
+        failures.append('incremental')
+    return failures
+
+def fuzz(rng, count):
+    messages = edgeMessages() + [randomMessage(rng) for i in range(count)]
+    failures = []
+    for number, message in enumerate(messages):
+        for failure in checkMessage(message, rng):
+            failures.append({'message': number, 'check': failure, 'records': [record.toDict() for record in message.getRecords()]})
+    return len(messages), failures
+
+def throughput(messages, seconds):
+    # encode and decode rounds over messages for about seconds each
+    buffers = [bytes(message.encode()) for message in messages]
+    size = sum(len(buffer) for buffer in buffers)
+    result = {}
+    for name, run in [('encode', lambda: [message.encode() for message in messages]),
+                      ('decode', lambda: [decode(buffer) for buffer in buffers])]:
+        rounds = 0
+        started = time.time()
+        while True:
+            run()
+            rounds += 1
+            elapsed = time.time() - started
+            if elapsed >= seconds:
+                break
+        result[name] = {'messages_per_sec': round(rounds * len(messages) / elapsed, 1),
+                        'mb_per_sec': round(rounds * size / elapsed / 1000000.0, 3),
+                        'us_per_message': round(elapsed * 1000000.0 / (rounds * len(messages)), 2)}
+    return result
+
+def gameMessages():
+    # what is on real tags, console and rom name
+    messages = []
+    for rom in ['Super Mario World (USA).sfc', 'Legend of Zelda, The - A Link to the Past (USA).sfc',
+                'Final Fantasy VII (USA) (Disc 1).chd', 'Tetris (World) (Rev A).gb']:
+        message = ndef.Message()
+        message.addTextRecord('snes')
+        message.addTextRecord(rom)
+        messages.append(message)
+    return messages
+
+def getParser():
+    parser = argparse.ArgumentParser(description='Round-trip fuzzing and throughput of the picontrol NDEF codec.')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default 1)')
+    parser.add_argument('--messages', type=int, default=2000, help='random messages to round-trip (default 2000)')
+    parser.add_argument('--seconds', type=float, default=1.0, help='seconds per throughput measurement (default 1)')
+    return parser
+
+def main(argv=None):
+    args = getParser().parse_args(argv)
+    rng = random.Random(args.seed)
+    checked, failures = fuzz(rng, args.messages)
+    result = {'seed': args.seed, 'checked': checked, 'failed': len(failures), 'failures': failures[:10],
+              'throughput': {'games': throughput(gameMessages(), args.seconds),
+                             'random': throughput([randomMessage(rng) for i in range(200)], args.seconds)}}
+    print(json.dumps(result, sort_keys=True, indent=4))
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
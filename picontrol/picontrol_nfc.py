@@ -1,6 +1,10 @@
-import time, binascii, json
+import os, time, binascii, threading, fcntl, ConfigParser
 import picontrol_PN532 as PN532 #Adafruit_PN532 as PN532
 import picontrol_ndef as ndef
+import picontrol_spi as spi
+import picontrol_cache as cache
+import picontrol_nfc_sim as nfcsim
+import picontrol_romindex as romindex
 
 SCLK = 4 #2 
 MISO = 17 #15
@@ -12,6 +16,32 @@ DEFAULT_KEY_A = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
 NDEF_A = [0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5]
 NDEF_B = [0xD3, 0xF7, 0xD3, 0xF7, 0xD3, 0xF7]
 
+configFilePath = r'/home/pi/scripts/picontrol/configs/config.conf'
+
+# the parsed config and the mtime it was parsed at, the file is only parsed
+# again after the webserver saved it
+configCache = [None, None]
+configLock = threading.Lock()
+
+def getConfig():
+    try:
+        mtime = os.stat(configFilePath).st_mtime
+    except OSError:
+        mtime = None
+    with configLock:
+        if configCache[0] is None or configCache[1] != mtime:
+            config = ConfigParser.RawConfigParser()
+            config.read(configFilePath)
+            configCache[:] = [config, mtime]
+        return configCache[0]
+
+def getSetting(option, default):
+    # settings live in the [nfc] section, older config files may not have it
+    try:
+        return getConfig().get("nfc", option)
+    except:
+        return default
+
 # response class, used for outputs
 class response(object):
     def __init__(self):
@@ -19,55 +49,344 @@ class response(object):
         self.data = ''
         self.message = ''
 
-    def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__, 
-            sort_keys=True, indent=4)
+    def toDict(self):
+        data = self.data
+        if hasattr(data, 'toDict'):
+            data = data.toDict()
+        elif isinstance(data, bytearray):
+            data = binascii.hexlify(data).decode('ascii')
+        return {'type': self.type, 'message': self.message, 'data': data}
 
-def getPn532():
+    def toJSON(self):
+        return ndef.toJSON(self.toDict())
+
+# reader session, the PN532 is initialized once and then kept configured.
+# Between operations the chip is powered down and woken up again on the next
+# acquire, which only costs a couple of milliseconds instead of begin()'s second.
+# The button scripts and the webserver share the reader, so a lock file keeps
+# their operations on it from interleaving. Every slot has its own session, the
+# readers only share the SPI bus (see busLock).
+class ReaderSession(object):
+    # seconds before a reader that failed to initialize is tried again, doubled
+    # on every failure up to MAX_RETRY_DELAY
+    RETRY_DELAY = 1.0
+    MAX_RETRY_DELAY = 30.0
+
+    def __init__(self, slot=0, lockPath=None):
+        if lockPath is None:
+            lockPath = '/dev/shm/picontrol_nfc.lock' if slot == 0 else '/dev/shm/picontrol_nfc.{0}.lock'.format(slot)
+        self.slot = slot
+        self.pn532 = None
+        self.lock = threading.RLock()
+        self.lockPath = lockPath
+        self.lockFile = None
+        self.depth = 0
+        self.failures = 0
+        self.retryAt = 0
+
+    def lockProcess(self):
+        try:
+            if self.lockFile is None:
+                self.lockFile = os.open(self.lockPath, os.O_RDONLY | os.O_CREAT, 0o666)
+            fcntl.flock(self.lockFile, fcntl.LOCK_EX)
+        except (IOError, OSError):
+            pass
+
+    def unlockProcess(self):
+        try:
+            if self.lockFile is not None:
+                fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+        except (IOError, OSError):
+            pass
+
+    def acquire(self):
+        self.lock.acquire()
+        self.depth += 1
+        if self.depth > 1:
+            # nested operation, the reader is awake already
+            return self.pn532
+        self.lockProcess()
+        try:
+            if self.pn532 is None:
+                # a missing or dead reader is not set up again on every poll
+                if time.time() >= self.retryAt:
+                    self.pn532 = getPn532(self.slot)
+                    if self.pn532 is None:
+                        self.failures += 1
+                        self.retryAt = time.time() + min(self.MAX_RETRY_DELAY, self.RETRY_DELAY * 2 ** (self.failures - 1))
+                    else:
+                        self.failures = 0
+            else:
+                self.pn532.wakeup()
+        except:
+            self.reset()
+        if self.pn532 is None:
+            self.unlock()
+        return self.pn532
+
+    def release(self):
+        try:
+            if self.pn532 is not None and self.depth == 1:
+                if self.pn532.trace is not None and getSetting("trace", "0") == "1":
+                    dumpTrace(self.pn532, self.slot)
+                if self.pn532.shutdown() is None:
+                    # no answer, the chip may have lost power and its configuration
+                    self.reset()
+        except:
+            # the chip did not answer, start from scratch next time
+            self.reset()
+        finally:
+            self.unlock()
+
+    def unlock(self):
+        self.depth -= 1
+        if self.depth == 0:
+            self.unlockProcess()
+        self.lock.release()
+
+    def reset(self):
+        # release the pins of the old reader, a new one is set up on the next acquire
+        if self.pn532 is not None:
+            try:
+                self.pn532.close()
+            except:
+                pass
+        self.pn532 = None
+
+# the readers of all slots take turns on the SPI bus per transfer
+busLock = spi.BusLock()
+
+sessions = {}
+sessionsLock = threading.Lock()
+
+def getSession(slot=0):
+    with sessionsLock:
+        if slot not in sessions:
+            sessions[slot] = ReaderSession(slot)
+        return sessions[slot]
+
+session = getSession(0)
+
+def getReaderPins():
+    # (cs, irq) of the reader of every slot, [nfc] cs = 22,5 sets up a slot per
+    # chip select. irq lists the IRQ pins in the same order, 0 for none
+    csPins = [int(pin) for pin in str(getSetting("cs", CS)).split(',')]
+    irqPins = [int(pin) for pin in str(getSetting("irq", 0)).split(',')]
+    return [(pin, irqPins[i] if i < len(irqPins) else 0) for i, pin in enumerate(csPins)]
+
+def traceDumpPath(slot=0):
+    # command trace of the reader, written after every operation while tracing
+    if slot == 0:
+        return '/dev/shm/picontrol_nfc_trace.json'
+    return '/dev/shm/picontrol_nfc_trace.{0}.json'.format(slot)
+
+def dumpTrace(pn532, slot=0):
     try:
-        pn532 = PN532.PN532(cs=CS, sclk=SCLK, mosi=MOSI, miso=MISO)
+        pn532.trace.dump(traceDumpPath(slot))
+    except (IOError, OSError):
+        pass
+
+def getSlots():
+    return list(range(len(getReaderPins())))
+
+# simulated PN532 used instead of the hardware when set, by [nfc] transport =
+# sim or by useSimulator() for tests and benchmarks
+simulators = {}
+
+def useSimulator(sim, slot=0):
+    simulators[slot] = sim
+    session = getSession(slot)
+    session.reset()
+    session.retryAt = 0
+
+def getTransport():
+    # bitbang (default) lets the driver toggle SCLK/MOSI/MISO from python,
+    # spidev uses the hardware SPI controller (SCLK 11, MOSI 10, MISO 9) and
+    # sim a simulated PN532 (see getPn532)
+    if getSetting("transport", "bitbang") == "spidev":
+        return spi.SpiDevLSB(int(getSetting("spibus", 0)), int(getSetting("spidevice", 0)))
+    return None
+
+# the chip selects of all readers were driven high, see deselectReaders
+readersDeselected = False
+
+def deselectReaders():
+    # drive the CS line of every configured reader high once before the first
+    # transfer, a reader whose CS floats or is pulled low would drive the shared
+    # MISO during the transfers of the others
+    global readersDeselected
+    if readersDeselected:
+        return
+    gpio = PN532.GPIO.get_platform_gpio()
+    for cs, irq in getReaderPins():
+        gpio.setup(cs, PN532.GPIO.OUT)
+        gpio.set_high(cs)
+    readersDeselected = True
+
+def getPn532(slot=0):
+    pn532 = None
+    try:
+        cs, irq = getReaderPins()[slot]
+        # irq = 0 keeps polling the SPI status byte
+        irq = irq or None
+        clock = int(getSetting("spispeed", 1000000))
+        if slot not in simulators and getSetting("transport", "bitbang") == "sim":
+            simulators[slot] = nfcsim.SimulatedPN532(nfcsim.create_tag(getSetting("simtag", "ntag215")),
+                                                     float(getSetting("simlatency", 0.005)))
+        simulator = simulators.get(slot)
+        if simulator is not None:
+            pn532 = PN532.PN532(cs=cs, gpio=simulator, spi=simulator, irq=irq, bus_lock=busLock)
+        else:
+            deselectReaders()
+            pn532 = PN532.PN532(cs=cs, sclk=SCLK, mosi=MOSI, miso=MISO, irq=irq,
+                                spi=getTransport(), clock_hz=clock, bus_lock=busLock)
+        # [nfc] trace = 1 records the timing of every PN532 command, see traceDumpPath
+        if getSetting("trace", "0") == "1":
+            pn532.enable_trace(int(getSetting("tracesize", 256)))
         pn532.begin()
         pn532.SAM_configuration()
+        # the PN532 polls for a tag itself until the host gives up waiting
+        pn532.set_passive_activation_retries(PN532.PN532_RETRIES_FOREVER)
         return pn532
     except:
+        if pn532 is not None:
+            pn532.close()
         return None
 
-def createBlockMatrix(data):
-    byteMatrix = [[None for x in range(16)] for y in range(44)]
-    valueArray = []
-    while data:
-        valueArray.append(data[:16].ljust(16))
-        data = data[16:]
-
-    idx = 0
-    while idx < len(byteMatrix):
-        byteMatrix[idx] = bytearray(16)
-        if len(valueArray) > idx:
-            byteMatrix[idx] = bytearray(valueArray[idx])
-        idx = idx + 1
-        
-    return byteMatrix
-
-def createPageMatrix(data):
-    byteMatrix = [[None for x in range(4)] for y in range(35)]
-    valueArray = []
-    while data:
-        valueArray.append(data[:4].ljust(4))
-        data = data[4:]
-
-    idx = 0
-    while idx < len(byteMatrix):
-        byteMatrix[idx] = bytearray(4)
-        if len(valueArray) > idx:
-            byteMatrix[idx] = bytearray(valueArray[idx])
-        idx = idx + 1
-        
-    return byteMatrix
+def runOperation(operation, *args):
+    return runSlotOperation(0, operation, *args)
+
+def runSlotOperation(slot, operation, *args):
+    # run operation(pn532, *args) on the reader of slot, if the transaction
+    # fails the reader is re-initialized and the operation is tried once more
+    session = getSession(slot)
+    attempts = 2
+    while True:
+        attempts -= 1
+        pn532 = session.acquire()
+        if pn532 is None:
+            resp = response()
+            resp.type = 'error'
+            resp.message = 'Unable to find NFC Device.'
+            resp.data = ''
+            return resp
+        try:
+            return operation(pn532, *args)
+        except:
+            session.reset()
+            if attempts <= 0:
+                raise
+        finally:
+            session.release()
+            saveKeys()
+
+# external type of the compact game record. Its payload is the console id, the
+# rom hash and the end of the rom file name needed to tell roms with the same
+# hash apart (usually nothing), see picontrol_romindex. A game fits in about 20
+# bytes instead of the two text records with the full rom file name.
+GAME_RECORD_TYPE = 'picontrol:g'
+
+def createGameMessage(console, rom, compact=None):
+    # message of a game, [nfc] compact = 1 writes the compact record for the
+    # consoles that have an id and roms the index finds, a compact record that
+    # does not resolve back to the rom would leave the tag unusable
+    if compact is None:
+        compact = getSetting("compact", "0") == "1"
+    message = ndef.Message()
+    consoleId = romindex.consoleId(console)
+    suffix = None
+    if compact and consoleId is not None:
+        suffix = romindex.index.suffix(console, rom)
+        if romindex.index.find(console, romindex.romHash(rom), suffix) != romindex.romName(rom):
+            suffix = None
+    if suffix is not None:
+        message.addExternalRecord(GAME_RECORD_TYPE, bytearray([consoleId]) + romindex.romHash(rom) + ndef.toBytes(suffix))
+    else:
+        message.addTextRecord(console)
+        message.addTextRecord(rom)
+    return message
+
+def gameFromMessage(message):
+    # (console, rom) of a game message of either format, None if the message
+    # has no game or the compact record matches no rom on this console
+    records = message.getRecords()
+    if len(records) >= 1 and records[0].ndefType == ndef.NDEF_EXTERNALRECORD:
+        if records[0].recordType != GAME_RECORD_TYPE:
+            return None
+        payload = bytearray(records[0].value)
+        if len(payload) < 1 + romindex.HASH_SIZE:
+            return None
+        console = romindex.consoleName(payload[0])
+        if console is None:
+            return None
+        hash = bytes(payload[1:1 + romindex.HASH_SIZE])
+        rom = romindex.index.find(console, hash, ndef.toText(memoryview(payload[1 + romindex.HASH_SIZE:])))
+        if rom is None:
+            return None
+        return console, rom
+    if len(records) >= 2:
+        return records[0].value, records[1].value
+    return None
+
+# uid -> {'console', 'rom'} of the tags read or written on this console
+registry = cache.JsonCache('tags.json', 1000)
+
+def uidKey(uid):
+    return binascii.hexlify(uid).decode('ascii')
+
+def registerTag(uid, message):
+    game = gameFromMessage(message)
+    if game is not None:
+        registry.set(uidKey(uid), {'console': game[0], 'rom': game[1]})
+    else:
+        registry.delete(uidKey(uid))
 
-def blockArray():
+def registeredMessage(uid):
+    entry = registry.get(uidKey(uid))
+    if entry is None:
+        return None
+    return createGameMessage(entry['console'], entry['rom'], False)
+
+def verifyRegistry(slot=0):
+    # read the whole tag to catch a registry entry that no longer matches it,
+    # a full read registers what is really on the tag
+    try:
+        read(False, slot)
+    except:
+        pass
+
+def scan(timeoutSec=0.2, slot=0):
+    # one short InListPassiveTarget, returns the uid of the tag or None
+    uid = runSlotOperation(slot, _scan, timeoutSec)
+    if isinstance(uid, response):
+        # no reader
+        return None
+    return uid
+
+def findTag(pn532, timeoutSec=None):
+    # one InListPassiveTarget that the PN532 retries in hardware until a tag
+    # answers, (atqa, sak, uid) or None once [nfc] scantimeout has passed
+    if timeoutSec is None:
+        timeoutSec = float(getSetting("scantimeout", 3))
+    return pn532.list_passive_target(timeout_sec=timeoutSec)
+
+def _scan(pn532, timeoutSec):
+    return pn532.read_passive_target(timeout_sec=timeoutSec)
+
+def createChunks(data, size, count):
+    # split data into zero padded chunks of size bytes followed by an empty
+    # chunk, which is where the reader stops, at most count chunks
+    chunks = []
+    for byteIndex in range(0, len(data), size):
+        chunk = bytearray(data[byteIndex:byteIndex+size])
+        chunks.append(chunk + bytearray(size - len(chunk)))
+    chunks.append(bytearray(size))
+    return chunks[:count]
+
+def blockArray(firstBlock=4, lastBlock=63):
     blocks = []
     skipper = 0
-    for i in range(4,64):
+    for i in range(firstBlock, lastBlock + 1):
         skip = False
         if skipper == 3:
             skipper = -1
@@ -77,6 +396,176 @@ def blockArray():
         skipper += 1
     return blocks
 
+# user memory of the supported tags as (family, first, last), pages for the
+# ntag2xx family and blocks including the sector trailers for mifareclassic.
+# ntag2xx and mifareclassic are the old fixed ranges for unidentified tags.
+TAG_TYPES = {
+    'ultralight': ('ntag2xx', 4, 15),
+    # MiFare Ultralight EV1
+    'mf0ul11': ('ntag2xx', 4, 15),
+    'mf0ul21': ('ntag2xx', 4, 35),
+    'ntag210': ('ntag2xx', 4, 15),
+    'ntag212': ('ntag2xx', 4, 35),
+    'ntag213': ('ntag2xx', 4, 39),
+    'ntag215': ('ntag2xx', 4, 129),
+    'ntag216': ('ntag2xx', 4, 225),
+    'ntag2xx': ('ntag2xx', 4, 38),
+    'mifareclassicmini': ('mifareclassic', 4, 19),
+    'mifareclassic': ('mifareclassic', 4, 63),
+    # only the 4 block sectors of a 4K
+    'mifareclassic4k': ('mifareclassic', 4, 127),
+}
+
+# GET_VERSION (product type, storage size) of the ntag2xx family
+TAG_VERSIONS = {
+    (0x03, 0x0B): 'mf0ul11',
+    (0x03, 0x0E): 'mf0ul21',
+    (0x04, 0x0B): 'ntag210',
+    (0x04, 0x0E): 'ntag212',
+    (0x04, 0x0F): 'ntag213',
+    (0x04, 0x11): 'ntag215',
+    (0x04, 0x13): 'ntag216',
+}
+
+CLASSIC_SAKS = {
+    0x08: 'mifareclassic',
+    0x88: 'mifareclassic',
+    0x09: 'mifareclassicmini',
+    0x18: 'mifareclassic4k',
+}
+
+# detected ntag2xx types by uid, saves the GET_VERSION round trip
+tagTypes = cache.JsonCache('tagtypes.json', 1000)
+
+def tagType(pn532, target):
+    # the TAG_TYPES name of the tag listed as target (atqa, sak, uid)
+    atqa, sak, uid = target
+    if sak in CLASSIC_SAKS:
+        return CLASSIC_SAKS[sak]
+    if sak != 0x00 or len(uid) != 7:
+        return 'mifareclassic' if len(uid) == 4 else 'ntag2xx'
+
+    key = uidKey(uid)
+    name = tagTypes.get(key)
+    if name in TAG_TYPES:
+        return name
+    version = pn532.ntag2xx_get_version()
+    if version is None:
+        # only the first Ultralight lacks GET_VERSION, it halts on it
+        pn532.read_passive_target()
+        name = 'ultralight'
+    else:
+        name = TAG_VERSIONS.get((version[2], version[6]), 'ntag2xx')
+    tagTypes.set(key, name)
+    return name
+
+# mifare classic access by sector, one authentication covers all 4 blocks of
+# a sector so it is only repeated when the next block is in another sector or
+# after a failed command, which drops the authentication on the card
+# key sets tried on a MiFare Classic sector, in order: the factory key B, the
+# NFC Forum public key A of NDEF sectors, the MAD key A of sector 0 and the
+# factory key A
+CLASSIC_KEYS = [
+    (PN532.MIFARE_CMD_AUTH_B, DEFAULT_KEY),
+    (PN532.MIFARE_CMD_AUTH_A, NDEF_B),
+    (PN532.MIFARE_CMD_AUTH_A, NDEF_A),
+    (PN532.MIFARE_CMD_AUTH_A, DEFAULT_KEY),
+]
+
+# index into CLASSIC_KEYS of the key that opened each sector, per tag uid
+keyCache = cache.JsonCache('keys.json', 250)
+
+# keys found during the running operations, saved together when they end
+# instead of once per sector
+foundKeys = {}
+foundKeysLock = threading.Lock()
+
+def saveKeys():
+    with foundKeysLock:
+        keys = dict(foundKeys)
+        foundKeys.clear()
+    if keys:
+        keyCache.update(keys)
+
+class ClassicTag(object):
+    def __init__(self, pn532, uid):
+        self.pn532 = pn532
+        self.uid = uid
+        self.sector = None
+        self.keys = dict(keyCache.get(uidKey(uid), {}))
+
+    def authenticate(self, block):
+        sector = block // 4
+        if sector != self.sector:
+            self.sector = None
+            # the key that worked last time first, then the others
+            known = self.keys.get(str(sector))
+            order = list(range(len(CLASSIC_KEYS)))
+            if known in order:
+                order.remove(known)
+                order.insert(0, known)
+            for attempt, index in enumerate(order):
+                if attempt > 0:
+                    # a failed authentication halts the card
+                    self.pn532.read_passive_target()
+                keyType, key = CLASSIC_KEYS[index]
+                if self.pn532.mifare_classic_authenticate_block(self.uid, block, keyType, key):
+                    self.sector = sector
+                    if index != known:
+                        self.keys[str(sector)] = index
+                        with foundKeysLock:
+                            foundKeys[uidKey(self.uid)] = dict(self.keys)
+                    return True
+            return False
+        return True
+
+    def recover(self):
+        # the card halts after a failed command, select it again
+        self.sector = None
+        self.pn532.read_passive_target()
+
+    def readBlock(self, block):
+        data = None
+        if self.authenticate(block):
+            data = self.pn532.mifare_classic_read_block(block)
+        if data is None:
+            self.recover()
+            if self.authenticate(block):
+                data = self.pn532.mifare_classic_read_block(block)
+        return data
+
+    def writeBlock(self, block, data):
+        written = self.authenticate(block) and self.pn532.mifare_classic_write_block(block, data)
+        if not written:
+            self.recover()
+            written = self.authenticate(block) and self.pn532.mifare_classic_write_block(block, data)
+        return written
+
+def readPages(pn532, firstPage, lastPage, fastRead=True):
+    # NTAG21x return the whole range with a FAST_READ per 60 pages, tags that
+    # do not know it get selected again and read 4 pages per READ instead
+    data = bytearray()
+    page = firstPage
+    while fastRead and page <= lastPage:
+        endPage = min(lastPage, page + PN532.NTAG2XX_FAST_READ_MAX_PAGES - 1)
+        chunk = pn532.ntag2xx_fast_read(page, endPage)
+        if chunk is None:
+            break
+        data += chunk
+        page = endPage + 1
+
+    if page <= lastPage:
+        if fastRead and pn532.read_passive_target() is None:
+            return None
+        while page <= lastPage:
+            chunk = pn532.ntag2xx_read_block(page)
+            if chunk is None:
+                return None
+            data += chunk[:(lastPage - page + 1) * 4]
+            page += 4
+
+    return data
+
 def isBlockEmpty(block):
     isEmpty = True
     for char in block:
@@ -84,235 +573,293 @@ def isBlockEmpty(block):
             isEmpty = False
     return isEmpty
 
-def write(message):
+def write(message, compare=True, slot=0, verify=False):
+    # with compare the tag is read first and only changed blocks/pages are written,
+    # with verify everything written is read back and compared byte for byte
+    return runSlotOperation(slot, _write, message, compare, verify)
+
+def _write(pn532, message, compare=True, verify=False):
     resp = response()
     buffer = message.encode()
-    pn532 = getPn532()    
     cardType = 'unknown'
 
-    if pn532 != None:
+    target = findTag(pn532)
+    if target is None:
+        resp.type = 'error'
+        resp.message = 'Unable to find tag, try reseating or tapping the tag and try again.'
+        resp.data = ''
+
+        return resp
+
+    uid = target[2]
+    tagName = tagType(pn532, target)
+    cardType, first, last = TAG_TYPES[tagName]
+
+    if cardType == 'mifareclassic':    
+        # if isFormated() == False:
+        #     format()    
 
-        maxAttempts = 5
-        attempts = 0
+        blocks = blockArray(first, last)
+        if len(buffer) > len(blocks) * 16:
+            resp.type = 'error'
+            resp.message = 'The message does not fit on the {0} tag.'.format(tagName)
+            resp.data = ''
 
-        uid = pn532.read_passive_target()
-        while uid is None:
-            if attempts >= maxAttempts:
+            return resp
+        bytesToWrite = createChunks(buffer, 16, len(blocks))
+        tag = ClassicTag(pn532, uid)
+
+        # we got a uid, now write the data
+        for block in range(len(bytesToWrite)):
+            if not tag.authenticate(blocks[block]):
                 resp.type = 'error'
-                resp.message = 'Unable to find tag, try reseating or tapping the tag and try again.'
+                resp.message = 'Failed to authenticate block {0} with the card.'.format(block)
                 resp.data = ''
-                pn532.shutdown()
-                
-                return response
-            uid = pn532.read_passive_target()
-            attempts = attempts + 1
-            time.sleep(.5)
-
-        if len(uid) == 4:
-            # we have a mifare classic
-            cardType = 'mifareclassic'
-        elif len(uid) == 7:
-            # we have a mifare ultralight or ntag2xx
-            cardType = 'ntag2xx'
-
-        if cardType == 'mifareclassic':    
-            # if isFormated() == False:
-            #     format()    
-
-            blocks = blockArray()
-            bytesToWrite = createBlockMatrix(buffer)
-
-            # we got a uid, now write the data
-            for block in range(len(blocks)):
-                if not pn532.mifare_classic_authenticate_block(uid, blocks[block], PN532.MIFARE_CMD_AUTH_B, DEFAULT_KEY):
-                    resp.type = 'error'
-                    resp.message = 'Failed to authenticate block {0} with the card.'.format(block)
-                    resp.data = ''
-                    pn532.shutdown()
 
-                    return resp
-                data = bytesToWrite[block]
+                return resp
+            data = bytesToWrite[block]
+
+            # the sector is authenticated already, reading it is cheaper than a write
+            if compare and tag.readBlock(blocks[block]) == data:
+                continue
+
+            if not tag.writeBlock(blocks[block], data):
+                resp.type = 'error'
+                resp.message = 'Failed to write block {0}!'.format(block)
+                resp.data = ''
+
+                return resp
 
-                if not pn532.mifare_classic_write_block(blocks[block], data):
+        if verify:
+            for block in range(len(bytesToWrite)):
+                if tag.readBlock(blocks[block]) != bytesToWrite[block]:
                     resp.type = 'error'
-                    resp.message = 'Failed to write block {0}!'.format(block)
+                    resp.message = 'Verification of block {0} failed!'.format(block)
                     resp.data = ''
-                    pn532.shutdown()
 
                     return resp
 
-                if isBlockEmpty(data):
-                    break
+        registerTag(uid, message)
+        resp.type = 'success'
+        resp.message = 'Message written successfully.'
+        resp.data = uidKey(uid)
 
-            resp.type = 'success'
-            resp.message = 'Message written successfully.'
+    elif cardType == 'ntag2xx':
+        pages = last - first + 1
+        if len(buffer) > pages * 4:
+            resp.type = 'error'
+            resp.message = 'The message does not fit on the {0} tag.'.format(tagName)
             resp.data = ''
-        
-        elif cardType == 'ntag2xx':
-            blocks = blockArray()
-            bytesToWrite = createPageMatrix(buffer)
 
-            #print(bytesToWrite)
-            
-            # data starts at page 4
-            page = 4
-            for i in range(0,34):
-                byteIndex = i*4
-                data = buffer[byteIndex:byteIndex+4]
-                len_diff = 4 - len(data)
-                data += "\0"*len_diff
-
-                #print(len(data))
-                #print(map(hex,data))
-
-                if not pn532.ntag2xx_write_page(page, data):
+            return resp
+        bytesToWrite = createChunks(buffer, 4, pages)
+
+        # read what is on the tag in one go, if that fails write every page
+        current = None
+        if compare:
+            current = readPages(pn532, first, first + len(bytesToWrite) - 1, tagName != 'ultralight')
+            if current is None:
+                pn532.read_passive_target()
+
+        for i in range(len(bytesToWrite)):
+            page = first + i
+            data = bytesToWrite[i]
+
+            if current is not None and current[i*4:i*4+4] == data:
+                continue
+
+            if not pn532.ntag2xx_write_page(page, data):
+                resp.type = 'error'
+                resp.message = 'Failed to write page {0}!'.format(page)
+                resp.data = ''
+
+                return resp
+
+        if verify:
+            # read back in bulk like the compare read
+            written = readPages(pn532, first, first + len(bytesToWrite) - 1, tagName != 'ultralight')
+            for i in range(len(bytesToWrite)):
+                if written is None or written[i*4:i*4+4] != bytesToWrite[i]:
                     resp.type = 'error'
-                    resp.message = 'Failed to write page {0}!'.format(page)
+                    resp.message = 'Verification of page {0} failed!'.format(first + i)
                     resp.data = ''
-                    pn532.shutdown()
 
                     return resp
-                page+=1
-                
-                if isBlockEmpty(data):
-                    break
-
-            resp.type = 'success'
-            resp.message = 'Message written successfully.'
-            resp.data = ''
 
-        # shutdown, were done writing
-        pn532.shutdown()
-    else:
-        resp.type = 'error'
-        resp.message = 'Unable to find NFC Device.'
-        resp.data = ''
+        registerTag(uid, message)
+        resp.type = 'success'
+        resp.message = 'Message written successfully.'
+        resp.data = uidKey(uid)
 
     return resp
 
-def read():
+def read(fastPath=None, slot=0):
+    # with the uid fast path a registered tag is answered from the registry as
+    # soon as its uid is known and the tag contents are checked in background
+    if fastPath is None:
+        fastPath = getSetting("uidfastpath", "0") == "1"
+    return runSlotOperation(slot, _read, fastPath, slot)
+
+def _read(pn532, fastPath=False, slot=0):
     # Format to NDEF if not already
     message = ndef.Message()
     resp = response()
-    blocks = blockArray()
-    pn532 = getPn532()    
-    cardType = 'unknown'
 
-    if pn532 != None:
+    resp.type = ""
+    resp.message = ""
+    resp.data = ""
+
+    target = findTag(pn532)
+    if target is None:
+        resp.type = 'error'
+        resp.message = 'Unable to find tag, try reseating or tapping the tag and try again.'
+        resp.data = ''
+
+        return resp
+
+    uid = target[2]
+
+    if fastPath:
+        message = registeredMessage(uid)
+        if message is not None:
+            # waits for the session until this read has released it
+            threading.Thread(target=verifyRegistry, args=(slot,)).start()
+
+            resp.type = "success"
+            resp.message = "success"
+            resp.data = message
+
+            return resp
+
+    tagName = tagType(pn532, target)
+    cardType, first, last = TAG_TYPES[tagName]
 
-        resp.type = ""
-        resp.message = ""
-        resp.data = ""
+    if cardType == 'mifareclassic':
+        # if isFormated() == False:
+        #     format()    
 
-        bufferFromCard = ''
-        maxAttempts = 2
-        attempts = 0
+        blocks = blockArray(first, last)
+        tag = ClassicTag(pn532, uid)
+        decoder = ndef.MessageDecoder()
 
-        uid = pn532.read_passive_target()
-        while uid is None:
-            if attempts >= maxAttempts:
+        # We got a uid, now read the data until the message is complete
+        for block in range(len(blocks)):
+            if not tag.authenticate(blocks[block]):
                 resp.type = 'error'
-                resp.message = 'Unable to find tag, try reseating or tapping the tag and try again.'
+                resp.message = 'Failed to authenticate block {0} with the card.'.format(block)
                 resp.data = ''
-                pn532.shutdown()
 
                 return resp
-            uid = pn532.read_passive_target()
-            attempts = attempts + 1
-            time.sleep(.2)    
-
-        if len(uid) == 4:
-            # we have a mifare classic
-            cardType = 'mifareclassic'
-        elif len(uid) == 7:
-            # we have a mifare ultralight or ntag2xx
-            cardType = 'ntag2xx'
-
-        if cardType == 'mifareclassic':
-            # if isFormated() == False:
-            #     format()    
-
-            # We got a uid, now read the data
-            for block in range(len(blocks)):
-                if not pn532.mifare_classic_authenticate_block(uid, blocks[block], PN532.MIFARE_CMD_AUTH_B, DEFAULT_KEY):
+            else:
+                data = tag.readBlock(blocks[block])
+                if data is None:
                     resp.type = 'error'
-                    resp.message = 'Failed to authenticate block {0} with the card.'.format(block)
+                    resp.message = 'Failed to read block {0}!'.format(block)
                     resp.data = ''
-                    pn532.shutdown()
 
                     return resp
-                else:
-                    data = pn532.mifare_classic_read_block(blocks[block])
-                    if data is None:
-                        resp.type = 'error'
-                        resp.message = 'Failed to read block {0}!'.format(block)
-                        resp.data = ''
-                        pn532.shutdown()
-
-                        return resp
-                    else:
-                        if isBlockEmpty(data):
-                            break
-                        bufferFromCard += data
+                elif decoder.feed(data) == 0:
+                    break
 
-            message.setBuffer(bufferFromCard)
-            message.decode()
+        message = decoder.message()
+        registerTag(uid, message)
+
+        resp.type = "success"
+        resp.message = "success"
+        resp.data = message
+
+    elif cardType == 'ntag2xx':
+        # the first read covers the TLV header and a typical game message, then
+        # exactly the pages the decoder still needs are read, most of a large
+        # tag is unused
+        fastRead = tagName != 'ultralight'
+        decoder = ndef.MessageDecoder()
+        page = first
+        needed = 64
+        while needed > 0 and page <= last:
+            count = (needed + 3) // 4
+            if not fastRead:
+                # READ returns 4 pages anyway
+                count = (count + 3) // 4 * 4
+            endPage = min(last, page + count - 1, page + PN532.NTAG2XX_FAST_READ_MAX_PAGES - 1)
+            pages = readPages(pn532, page, endPage, fastRead)
+            if pages is None:
+                resp.type = 'error'
+                resp.message = 'Failed to read pages {0} to {1}!'.format(page, endPage)
+                resp.data = ''
 
-            resp.type = "success"
-            resp.message = "success"
-            resp.data = message
+                return resp
 
-        elif cardType == 'ntag2xx':
-            # data starts at page 4
-            for page in range(4,39):
-                data = pn532.ntag2xx_read_page(page)
-                if data is None:
-                    resp.type = 'error'
-                    resp.message = 'Failed to read page {0}!'.format(page)
-                    resp.data = ''
-                else:
-                    if isBlockEmpty(data):
-                        break
-                    bufferFromCard += data
+            needed = decoder.feed(pages)
+            page = endPage + 1
 
-            if bufferFromCard[0] != 0x3:
-                #we move forward 5 bytes to get us to the ndef records
-                newBuffer = bufferFromCard[5:]
-                bufferFromCard = newBuffer
+        # the decoder skips the lock and memory control TLVs in front of the message
+        message = decoder.message()
+        registerTag(uid, message)
 
-            message.setBuffer(bufferFromCard)
-            message.decode()
+        resp.type = "success"
+        resp.message = "success"
+        resp.data = message
 
-            resp.type = "success"
-            resp.message = "success"
-            resp.data = message
+    return resp
 
-        # shutdown, were done reading
-        pn532.shutdown()
-    else:
+def dump(slot=0):
+    # raw memory of the tag, the pages or blocks as hex strings
+    return runSlotOperation(slot, _dump)
+
+def _dump(pn532):
+    resp = response()
+
+    target = findTag(pn532)
+    if target is None:
         resp.type = 'error'
-        resp.message = 'Unable to find NFC Device.'
+        resp.message = 'Unable to find tag, try reseating or tapping the tag and try again.'
         resp.data = ''
-        
+
+        return resp
+
+    uid = target[2]
+    tagName = tagType(pn532, target)
+    cardType, first, last = TAG_TYPES[tagName]
+    rows = []
+
+    if cardType == 'mifareclassic':
+        # every block of the sectors in use, sector trailers included
+        tag = ClassicTag(pn532, uid)
+        for block in range(0, (last // 4 + 1) * 4):
+            data = tag.readBlock(block)
+            rows.append(binascii.hexlify(data).decode('ascii') if data is not None else None)
+    else:
+        # the header pages and the user memory
+        pages = readPages(pn532, 0, last, tagName != 'ultralight')
+        if pages is None:
+            resp.type = 'error'
+            resp.message = 'Failed to read pages 0 to {0}!'.format(last)
+            resp.data = ''
+
+            return resp
+        for byteIndex in range(0, len(pages), 4):
+            rows.append(binascii.hexlify(pages[byteIndex:byteIndex+4]).decode('ascii'))
+
+    resp.type = 'success'
+    resp.message = 'success'
+    resp.data = {'uid': uidKey(uid), 'type': tagName, 'memory': rows}
     return resp
 
-def isFormated():
+def isFormated(slot=0):
+    return runSlotOperation(slot, _isFormated)
+
+def _isFormated(pn532):
     resp = response()
-    pn532 = getPn532()
 
-    maxAttempts = 5
-    attempts = 0
+    target = findTag(pn532)
+    if target is None:
+        resp.type = 'error'
+        resp.message = 'Unable to find tag, try reseating or tapping the tag and try again.'
 
-    uid = pn532.read_passive_target()
-    while uid is None:
-        if attempts >= maxAttempts:
-            resp.type = 'error'
-            resp.message = 'Unable to find tag, try reseating or tapping the tag and try again.'
+        return resp
 
-            return resp
-        uid = pn532.read_passive_target()
-        attempts = attempts + 1
-        time.sleep(.5)    
+    uid = target[2]
 
     # We got a uid, now read
     if not pn532.mifare_classic_authenticate_block(uid, 1, PN532.MIFARE_CMD_AUTH_B, DEFAULT_KEY):
@@ -331,9 +878,11 @@ def isFormated():
     else:
         return False
 
-def format():
+def format(slot=0):
+    return runSlotOperation(slot, _format)
+
+def _format(pn532):
     resp = response()
-    pn532 = getPn532()    
 
     sectorbuffer1 = [0x14, 0x01, 0x03, 0xE1, 0x03, 0xE1, 0x03, 0xE1, 0x03, 0xE1, 0x03, 0xE1, 0x03, 0xE1, 0x03, 0xE1]
     sectorbuffer2 = [0x03, 0xE1, 0x03, 0xE1, 0x03, 0xE1, 0x03, 0xE1, 0x03, 0xE1, 0x03, 0xE1, 0x03, 0xE1, 0x03, 0xE1]
@@ -347,20 +896,15 @@ def format():
     # Note 0xA0 0xA1 0xA2 0xA3 0xA4 0xA5 must be used for key A
     # for the MAD sector in NDEF records (sector 0)
 
-    maxAttempts = 5
-    attempts = 0
+    target = findTag(pn532)
+    if target is None:
+        resp.type = 'error'
+        resp.message = 'Unable to find tag, try reseating or tapping the tag and try again.'
+        resp.data = ''
 
-    uid = pn532.read_passive_target()
-    while uid is None:
-        if attempts >= maxAttempts:
-            resp.type = 'error'
-            resp.message = 'Unable to find tag, try reseating or tapping the tag and try again.'
-            resp.data = ''
+        return resp
 
-            return resp
-        uid = pn532.read_passive_target()
-        attempts = attempts + 1
-        time.sleep(.5)    
+    uid = target[2]
 
     # We got a uid, now format
     if not pn532.mifare_classic_authenticate_block(uid, 1, PN532.MIFARE_CMD_AUTH_B, DEFAULT_KEY):
@@ -418,36 +962,34 @@ def format():
     resp.message = ''
     resp.data = ''
 
-    pn532.shutdown()
 
     return resp
 
-def dumpMAD():
+def dumpMAD(slot=0):
+    return runSlotOperation(slot, _dumpMAD)
+
+def _dumpMAD(pn532):
     resp = response()
-    pn532 = getPn532()
 
-    maxAttempts = 5
-    attempts = 0
+    target = findTag(pn532)
+    if target is None:
+        resp.type = 'error'
+        resp.message = 'Unable to find tag, try reseating or tapping the tag and try again.'
+
+        return resp
 
-    uid = pn532.read_passive_target()
-    while uid is None:
-        if attempts >= maxAttempts:
-            resp.type = 'error'
-            resp.message = 'Unable to find tag, try reseating or tapping the tag and try again.'
+    uid = target[2]
 
-            return resp
-        uid = pn532.read_passive_target()
-        attempts = attempts + 1
-        time.sleep(.5)    
+    tag = ClassicTag(pn532, uid)
 
     # We got a uid, now read
     for block in range(0,64):
 
-        if not pn532.mifare_classic_authenticate_block(uid, block, PN532.MIFARE_CMD_AUTH_B, DEFAULT_KEY):
+        if not tag.authenticate(block):
             return False
         else:
             
-            sectorbuffer = pn532.mifare_classic_read_block(block)
+            sectorbuffer = tag.readBlock(block)
             sb = binascii.hexlify(sectorbuffer)
 
             print(sb)
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# picontrol-nfc, command line access to the NFC reader for diagnostics and
+# benchmarks. Every command runs against the reader of a slot or, with --sim,
+# against a simulated PN532 with a simulated tag (see picontrol_nfc_sim).
+#
+#   python picontrol_nfc_cli.py read
+#   python picontrol_nfc_cli.py write snes "Super Mario World (USA).sfc"
+#   python picontrol_nfc_cli.py --sim ntag215 bench -n 100 --write
+from __future__ import print_function
+import sys, time, json, math, argparse
+import picontrol_nfc as nfc
+import picontrol_ndef as ndef
+import picontrol_nfc_sim as nfcsim
+import picontrol_monitor as monitor
+
+def printJSON(data):
+    print(json.dumps(data, sort_keys=True, indent=4))
+
+def responseJSON(resp):
+    data = resp.data
+    if isinstance(data, ndef.Message):
+        game = nfc.gameFromMessage(data)
+        data = {'records': list(game) if game is not None else []}
+    return {'type': resp.type, 'message': resp.message, 'data': data}
+
+def percentile(values, percent):
+    # nearest rank percentile of sorted values
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(0, min(len(values), rank) - 1)]
+
+def latencySummary(latencies):
+    values = sorted(latencies)
+    if not values:
+        return {}
+    return {'min': values[0], 'p50': percentile(values, 50), 'p90': percentile(values, 90),
+            'p99': percentile(values, 99), 'max': values[-1],
+            'mean': round(sum(values) / len(values), 3)}
+
+def commandCount(pn532):
+    # PN532 commands sent so far, counted by the trace
+    if pn532 is None or pn532.trace is None:
+        return 0
+    return sum(histogram['count'] for histogram in pn532.trace.histograms().values())
+
+def enableTrace(slot):
+    # trace the session reader to count the transactions of every operation
+    session = nfc.getSession(slot)
+    pn532 = session.acquire()
+    try:
+        if pn532 is not None and pn532.trace is None:
+            pn532.enable_trace()
+    finally:
+        if pn532 is not None:
+            session.release()
+    return pn532
+
+def measure(slot, operation, *args):
+    # (resp, milliseconds, transactions) of one operation
+    before = commandCount(nfc.getSession(slot).pn532)
+    started = time.time()
+    resp = operation(*args)
+    elapsed = round((time.time() - started) * 1000.0, 3)
+    # a reader that was re-initialized on the way has a new, empty trace
+    return resp, elapsed, max(0, commandCount(nfc.getSession(slot).pn532) - before)
+
+def commandRead(args):
+    printJSON(responseJSON(nfc.read(False, args.slot)))
+
+def commandWrite(args):
+    resp = nfc.write(nfc.createGameMessage(args.console, args.rom, args.compact or None), not args.full, args.slot, args.verify)
+    printJSON(responseJSON(resp))
+
+def commandDump(args):
+    printJSON(responseJSON(nfc.dump(args.slot)))
+
+def commandBench(args):
+    if enableTrace(args.slot) is None:
+        printJSON({'type': 'error', 'message': 'Unable to find NFC Device.', 'data': ''})
+        return 1
+
+    original = None
+    if args.write:
+        # put the game that is on the tag back afterwards
+        original = nfc.read(False, args.slot)
+
+    operations = {'read': {'latencies': [], 'transactions': [], 'errors': 0}}
+    if args.write:
+        operations['write'] = {'latencies': [], 'transactions': [], 'errors': 0}
+
+    for run in range(args.runs):
+        if args.write:
+            # alternate between two games so every run really writes
+            message = nfc.createGameMessage(args.console, '{0}-{1}'.format(args.rom, run % 2))
+            resp, elapsed, transactions = measure(args.slot, nfc.write, message, not args.full, args.slot)
+            stats = operations['write']
+            stats['latencies'].append(elapsed)
+            stats['transactions'].append(transactions)
+            if resp.type != 'success':
+                stats['errors'] += 1
+
+        resp, elapsed, transactions = measure(args.slot, nfc.read, False, args.slot)
+        stats = operations['read']
+        stats['latencies'].append(elapsed)
+        stats['transactions'].append(transactions)
+        if resp.type != 'success':
+            stats['errors'] += 1
+
+    if original is not None and original.type == 'success':
+        nfc.write(original.data, True, args.slot)
+
+    result = {'runs': args.runs, 'slot': args.slot, 'sim': args.sim, 'operations': {}}
+    for name, stats in operations.items():
+        result['operations'][name] = {
+            'errors': stats['errors'],
+            'latency_ms': latencySummary(stats['latencies']),
+            'transactions_per_op': round(float(sum(stats['transactions'])) / max(1, len(stats['transactions'])), 2),
+        }
+    pn532 = nfc.getSession(args.slot).pn532
+    if pn532 is not None and pn532.trace is not None:
+        result['commands'] = dict((histogram['name'], {'count': histogram['count'],
+                                                       'mean_ms': round(histogram['total_ms'] / histogram['count'], 3),
+                                                       'max_ms': histogram['max_ms']})
+                                  for histogram in pn532.trace.histograms().values())
+    printJSON(result)
+    return 0
+
+def commandWatch(args):
+    tagMonitor = monitor.TagMonitor(args.interval, slot=args.slot, publish=False)
+
+    def changed(event, uid, message):
+        game = nfc.gameFromMessage(message) if message is not None else None
+        records = list(game) if game is not None else []
+        print(json.dumps({'time': round(time.time(), 3), 'event': event, 'uid': nfc.uidKey(uid), 'records': records}))
+        sys.stdout.flush()
+
+    tagMonitor.subscribe(changed)
+    tagMonitor.start()
+    try:
+        while tagMonitor.is_alive():
+            tagMonitor.join(1)
+    except KeyboardInterrupt:
+        tagMonitor.stop()
+
+def getParser():
+    parser = argparse.ArgumentParser(prog='picontrol-nfc', description='Read, write and benchmark the picontrol NFC reader.')
+    parser.add_argument('--slot', type=int, default=0, help='reader slot (default 0)')
+    parser.add_argument('--sim', metavar='TAG', help='use a simulated PN532 with a tag: ntag213, ntag215, ntag216, ultralight, classic or none')
+    parser.add_argument('--latency', type=float, default=0.005, help='simulated PN532 command latency in seconds (default 0.005)')
+    commands = parser.add_subparsers(dest='command')
+
+    command = commands.add_parser('read', help='read the game on the tag')
+    command.set_defaults(run=commandRead)
+
+    command = commands.add_parser('write', help='write a game to the tag')
+    command.add_argument('console')
+    command.add_argument('rom')
+    command.add_argument('--full', action='store_true', help='write every page instead of only the changed ones')
+    command.add_argument('--verify', action='store_true', help='read the tag back and compare')
+    command.add_argument('--compact', action='store_true', help='write the compact game record whatever [nfc] compact says')
+    command.set_defaults(run=commandWrite)
+
+    command = commands.add_parser('dump', help='print the raw tag memory')
+    command.set_defaults(run=commandDump)
+
+    command = commands.add_parser('bench', help='time read (and write) cycles and print JSON statistics')
+    command.add_argument('-n', '--runs', type=int, default=20, help='number of cycles (default 20)')
+    command.add_argument('--write', action='store_true', help='also time writes, the tag content is restored afterwards')
+    command.add_argument('--full', action='store_true', help='write every page instead of only the changed ones')
+    command.add_argument('--console', default='bench', help='console record of the written game')
+    command.add_argument('--rom', default='bench.rom', help='rom record of the written game')
+    command.set_defaults(run=commandBench)
+
+    command = commands.add_parser('watch', help='print tag insert and remove events as JSON lines')
+    command.add_argument('--interval', type=float, default=0.5, help='seconds between scans (default 0.5)')
+    command.set_defaults(run=commandWatch)
+    return parser
+
+def main(argv=None):
+    args = getParser().parse_args(argv)
+    if not hasattr(args, 'run'):
+        getParser().print_help()
+        return 2
+    if args.sim is not None:
+        nfc.useSimulator(nfcsim.SimulatedPN532(nfcsim.create_tag(args.sim), args.latency), args.slot)
+    return args.run(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,432 @@
+# Simulated PN532 and tags for running the NFC code without the hardware.
+#
+# SimulatedPN532 stands in for both the gpio and the spi the PN532 driver is
+# given, and answers on the SPI frame level: it checks the preamble, LEN/LCS
+# and DCS of every command frame, acknowledges it, and returns the response
+# frame once the configured latency has passed (signalling it through the
+# status byte or the IRQ line).  Tags emulate the memory maps of NTAG213/215/
+# 216, MiFare Ultralight and MiFare Classic 1K including sector keys.
+#
+#   simulator = SimulatedPN532(NtagTag('ntag215'), latency=0.005)
+#   pn532 = PN532.PN532(cs=22, gpio=simulator, spi=simulator)
+import os
+import threading
+import time
+
+import picontrol_PN532 as PN532
+
+
+# PN532 status codes used by the simulation.
+STATUS_OK                           = 0x00
+STATUS_TIMEOUT                      = 0x01
+STATUS_AUTH_ERROR                   = 0x14
+
+# NTAG21x / Ultralight commands that only exist on the tag side.
+NTAG2XX_CMD_GET_VERSION             = 0x60
+
+DEFAULT_KEY                         = bytearray([0xFF]*6)
+MAD_KEY                             = bytearray([0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5])
+NDEF_KEY                            = bytearray([0xD3, 0xF7, 0xD3, 0xF7, 0xD3, 0xF7])
+# Transport configuration access bits, key B readable.
+DEFAULT_ACCESS                      = bytearray([0xFF, 0x07, 0x80, 0x69])
+
+
+class TagHalted(Exception):
+    """Raised by a tag that does not answer, it stays silent until selected."""
+
+
+class TagAuthFailed(TagHalted):
+    """Raised by a MiFare Classic tag when an authentication fails."""
+
+
+class SimulatedTag(object):
+    """Base class of the simulated ISO14443A tags."""
+
+    def __init__(self, uid, atqa, sak):
+        self.uid = bytearray(uid)
+        self.atqa = bytearray(atqa)
+        self.sak = sak
+        self.halted = False
+
+    def select(self):
+        """Wake the tag up and select it (WUPA + anticollision + SELECT)."""
+        self.halted = False
+
+    def exchange(self, data):
+        """Handle a PN532 InDataExchange and return the response bytes."""
+        raise TagHalted()
+
+    def communicate(self, data):
+        """Handle a raw frame from PN532 InCommunicateThru."""
+        raise TagHalted()
+
+
+class NtagTag(SimulatedTag):
+    """NTAG213/215/216 or MiFare Ultralight memory of 4 byte pages."""
+
+    # pages, last user memory page, CC data area size, GET_VERSION storage size
+    TYPES = {
+        'ultralight': (16, 15, 0x06, None),
+        'ntag213': (45, 39, 0x12, 0x0F),
+        'ntag215': (135, 129, 0x3E, 0x11),
+        'ntag216': (231, 225, 0x6D, 0x13),
+    }
+
+    def __init__(self, tag_type='ntag215', uid=None):
+        if uid is None:
+            uid = bytearray([0x04]) + bytearray(os.urandom(6))
+        SimulatedTag.__init__(self, uid, [0x00, 0x44], 0x00)
+        self.tag_type = tag_type
+        pages, self.last_user_page, cc_size, self.storage_size = self.TYPES[tag_type]
+        self.memory = bytearray(pages*4)
+        uid = self.uid
+        self.memory[0:4] = bytearray([uid[0], uid[1], uid[2], 0x88 ^ uid[0] ^ uid[1] ^ uid[2]])
+        self.memory[4:8] = uid[3:7]
+        self.memory[8] = uid[3] ^ uid[4] ^ uid[5] ^ uid[6]
+        self.memory[12:16] = bytearray([0xE1, 0x10, cc_size, 0x00])
+        # Empty NDEF message.
+        self.memory[16:19] = bytearray([0x03, 0x00, 0xFE])
+
+    @property
+    def pages(self):
+        return len(self.memory) // 4
+
+    def _nak(self):
+        self.halted = True
+        raise TagHalted()
+
+    def _read(self, page):
+        if page >= self.pages:
+            self._nak()
+        # Reads roll over to page 0 at the end of the memory.
+        data = bytearray()
+        for i in range(4):
+            index = ((page + i) % self.pages)*4
+            data += self.memory[index:index+4]
+        return data
+
+    def _command(self, data):
+        command = data[0]
+        if command == PN532.MIFARE_CMD_READ:
+            return self._read(data[1])
+        if command == PN532.NTAG2XX_CMD_FAST_READ and self.storage_size is not None:
+            start, end = data[1], data[2]
+            if start > end or end >= self.pages:
+                self._nak()
+            return self.memory[start*4:(end + 1)*4]
+        if command == NTAG2XX_CMD_GET_VERSION and self.storage_size is not None:
+            return bytearray([0x00, 0x04, 0x04, 0x02, 0x01, 0x00, self.storage_size, 0x03])
+        if command == PN532.MIFARE_ULTRALIGHT_CMD_WRITE and len(data) >= 6:
+            page = data[1]
+            if page < 4 or page > self.last_user_page:
+                self._nak()
+            self.memory[page*4:page*4+4] = data[2:6]
+            return bytearray()
+        self._nak()
+
+    def exchange(self, data):
+        if self.halted:
+            raise TagHalted()
+        if data[0] in (PN532.MIFARE_CMD_AUTH_A, PN532.MIFARE_CMD_AUTH_B):
+            # The PN532 runs a MiFare authentication, which the tag refuses.
+            self._nak()
+        return self._command(data)
+
+    def communicate(self, data):
+        if self.halted:
+            raise TagHalted()
+        return self._command(data)
+
+
+class ClassicTag(SimulatedTag):
+    """MiFare Classic 1K with 16 sectors of 4 blocks and per sector keys."""
+
+    def __init__(self, uid=None, keys=None):
+        """Keys optionally maps sector numbers to (key A, key B) tuples, the
+        other sectors use the default transport keys.
+        """
+        if uid is None:
+            uid = bytearray(os.urandom(4))
+        SimulatedTag.__init__(self, uid, [0x00, 0x04], 0x08)
+        self.memory = bytearray(64*16)
+        uid = self.uid
+        self.memory[0:8] = uid + bytearray([uid[0] ^ uid[1] ^ uid[2] ^ uid[3], 0x08, 0x04, 0x00])
+        keys = keys or {}
+        for sector in range(16):
+            key_a, key_b = keys.get(sector, (DEFAULT_KEY, DEFAULT_KEY))
+            trailer = (sector*4 + 3)*16
+            self.memory[trailer:trailer+16] = bytearray(key_a) + DEFAULT_ACCESS + bytearray(key_b)
+        self.sector = None
+
+    def select(self):
+        SimulatedTag.select(self)
+        self.sector = None
+
+    def _fail(self):
+        self.halted = True
+        self.sector = None
+        raise TagHalted()
+
+    def exchange(self, data):
+        if self.halted:
+            raise TagHalted()
+        command = data[0]
+        block = data[1]
+        if block >= 64:
+            self._fail()
+        sector = block // 4
+        trailer = (sector*4 + 3)*16
+        if command in (PN532.MIFARE_CMD_AUTH_A, PN532.MIFARE_CMD_AUTH_B):
+            key = data[2:8]
+            uid = data[8:8+len(self.uid)]
+            if command == PN532.MIFARE_CMD_AUTH_A:
+                expected = self.memory[trailer:trailer+6]
+            else:
+                expected = self.memory[trailer+10:trailer+16]
+            if key != expected or uid != self.uid:
+                self.halted = True
+                self.sector = None
+                raise TagAuthFailed()
+            self.sector = sector
+            return bytearray()
+        if self.sector != sector:
+            self._fail()
+        if command == PN532.MIFARE_CMD_READ:
+            data = self.memory[block*16:block*16+16]
+            if block % 4 == 3:
+                # Key A never reads back.
+                data[0:6] = bytearray(6)
+            return data
+        if command == PN532.MIFARE_CMD_WRITE and len(data) >= 18 and block != 0:
+            self.memory[block*16:block*16+16] = data[2:18]
+            return bytearray()
+        self._fail()
+
+
+def create_tag(tag_type):
+    """Create a tag by name: ntag213, ntag215, ntag216, ultralight, classic or
+    none for an empty field.
+    """
+    if tag_type == 'none':
+        return None
+    if tag_type == 'classic':
+        return ClassicTag()
+    return NtagTag(tag_type)
+
+
+class SimulatedPN532(object):
+    """PN532 on the SPI bus, used as both the gpio and the spi of the PN532
+    driver.  Every command takes latency seconds before its response is ready.
+    """
+
+    def __init__(self, tag=None, latency=0.0):
+        self.tag = tag
+        self.latency = latency
+        self.selected = None
+        self.asleep = False
+        # Power down takes effect once its response has been read.
+        self._sleep_pending = False
+        self.passive_retries = 0xFF
+        self.cs = None
+        self.irq = None
+        self._irq_callback = None
+        self._ack_pending = False
+        self._response = None
+        self._ready_at = 0
+        # An InListPassiveTarget still waiting for a tag.
+        self._listing = False
+        # Statistics for tests and benchmarks.
+        self.transactions = 0
+        self.commands = {}
+
+    # Tag handling.
+    def insert(self, tag):
+        self.tag = tag
+        self.selected = None
+        if self._listing:
+            # The waiting InListPassiveTarget finds the tag right away.
+            self._listing = False
+            self._respond(PN532.PN532_COMMAND_INLISTPASSIVETARGET, self._list_passive_target())
+            if self._irq_callback is not None and not self._ack_pending:
+                self._irq_callback(self.irq)
+
+    def remove(self):
+        self.tag = None
+        self.selected = None
+
+    # GPIO interface.
+    def setup(self, pin, mode, pull_up_down=None):
+        if mode == PN532.GPIO.OUT:
+            self.cs = pin
+        else:
+            self.irq = pin
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=-1):
+        # RPi.GPIO refuses a second edge detection on a pin
+        if self._irq_callback is not None:
+            raise RuntimeError('Conflicting edge detection already enabled for this GPIO channel')
+        self._irq_callback = callback
+
+    def remove_event_detect(self, pin):
+        self._irq_callback = None
+
+    def set_low(self, pin):
+        # Asserting CS wakes the PN532 from power down.
+        if pin == self.cs:
+            self.asleep = False
+
+    def set_high(self, pin):
+        pass
+
+    def is_low(self, pin):
+        return pin == self.irq and self._ready()
+
+    def is_high(self, pin):
+        return not self.is_low(pin)
+
+    # SPI interface.
+    def set_clock_hz(self, hz):
+        pass
+
+    def set_mode(self, mode):
+        pass
+
+    def set_bit_order(self, order):
+        pass
+
+    def write(self, data):
+        data = bytearray(data)
+        if data[0] != PN532.PN532_SPI_DATAWRITE:
+            raise RuntimeError('Simulated PN532 expected a data write!')
+        if data == PN532.PN532_ACK:
+            # The host aborts the running command.
+            self._ack_pending = False
+            self._response = None
+            self._listing = False
+            return
+        if self.asleep:
+            return
+        command, params = self._parse_frame(data[1:])
+        self.transactions += 1
+        self.commands[command] = self.commands.get(command, 0) + 1
+        self._ack_pending = True
+        self._response = None
+        self._listing = False
+        response = self._execute(command, params)
+        if response is not None:
+            self._respond(command, response)
+        if self._irq_callback is not None:
+            # IRQ drops for the ACK right away.
+            self._irq_callback(self.irq)
+
+    def transfer(self, data):
+        data = bytearray(data)
+        if data[0] == PN532.PN532_SPI_STATREAD:
+            status = PN532.PN532_SPI_READY if self._ready() else 0x00
+            return bytearray([0x00, status]) + bytearray(len(data) - 2)
+        if data[0] == PN532.PN532_SPI_DATAREAD:
+            if self._ack_pending:
+                self._ack_pending = False
+                frame = PN532.PN532_ACK
+                if self._response is not None and self._irq_callback is not None:
+                    delay = max(0, self._ready_at - time.time())
+                    timer = threading.Timer(delay, self._irq_callback, [self.irq])
+                    timer.daemon = True
+                    timer.start()
+            elif self._ready():
+                frame = self._response
+                self._response = None
+                if self._sleep_pending:
+                    self._sleep_pending = False
+                    self.asleep = True
+            else:
+                frame = bytearray()
+            frame = bytearray(frame[:len(data)])
+            return frame + bytearray(len(data) - len(frame))
+        raise RuntimeError('Simulated PN532 got an unknown SPI operation!')
+
+    def read(self, length):
+        return self.transfer(bytearray([PN532.PN532_SPI_DATAREAD]) + bytearray(length - 1))
+
+    # Frame handling.
+    def _respond(self, command, response):
+        self._response = self._build_frame(command, response)
+        self._ready_at = time.time() + self.latency
+
+    def _ready(self):
+        if self.asleep:
+            return False
+        if self._ack_pending:
+            return True
+        return self._response is not None and time.time() >= self._ready_at
+
+    def _parse_frame(self, frame):
+        if frame[0:3] != bytearray([PN532.PN532_PREAMBLE, PN532.PN532_STARTCODE1, PN532.PN532_STARTCODE2]):
+            raise RuntimeError('Simulated PN532 got a frame without preamble!')
+        length = frame[3]
+        if (length + frame[4]) & 0xFF != 0:
+            raise RuntimeError('Simulated PN532 got a wrong length checksum!')
+        data = frame[5:5+length]
+        if (sum(data) + frame[5+length]) & 0xFF != 0:
+            raise RuntimeError('Simulated PN532 got a wrong data checksum!')
+        if data[0] != PN532.PN532_HOSTTOPN532:
+            raise RuntimeError('Simulated PN532 got a frame not meant for it!')
+        return data[1], data[2:]
+
+    def _build_frame(self, command, response):
+        data = bytearray([PN532.PN532_PN532TOHOST, (command + 1) & 0xFF]) + response
+        length = len(data)
+        frame = bytearray([0x01, PN532.PN532_PREAMBLE, PN532.PN532_STARTCODE1, PN532.PN532_STARTCODE2,
+                           length, (~length + 1) & 0xFF])
+        frame += data
+        frame.append((~sum(data) + 1) & 0xFF)
+        frame.append(PN532.PN532_POSTAMBLE)
+        return frame
+
+    # Commands.
+    def _execute(self, command, params):
+        if command == PN532.PN532_COMMAND_GETFIRMWAREVERSION:
+            return bytearray([0x32, 0x01, 0x06, 0x07])
+        if command == PN532.PN532_COMMAND_SAMCONFIGURATION:
+            return bytearray()
+        if command == PN532.PN532_COMMAND_POWERDOWN:
+            self._sleep_pending = True
+            self.selected = None
+            return bytearray([STATUS_OK])
+        if command == PN532.PN532_COMMAND_RFCONFIGURATION:
+            if params[0] == 0x05:
+                self.passive_retries = params[3]
+            return bytearray()
+        if command == PN532.PN532_COMMAND_INLISTPASSIVETARGET:
+            return self._list_passive_target()
+        if command in (PN532.PN532_COMMAND_INRELEASE, PN532.PN532_COMMAND_INDESELECT):
+            self.selected = None
+            return bytearray([STATUS_OK])
+        if command == PN532.PN532_COMMAND_INDATAEXCHANGE:
+            return self._to_tag(self.selected and self.selected.exchange, params[1:])
+        if command == PN532.PN532_COMMAND_INCOMMUNICATETHRU:
+            return self._to_tag(self.selected and self.selected.communicate, params)
+        raise RuntimeError('Simulated PN532 does not implement command 0x{0:02X}!'.format(command))
+
+    def _list_passive_target(self):
+        if self.tag is None:
+            # With infinite retries the PN532 keeps looking until a tag is
+            # inserted or the command is aborted.
+            if self.passive_retries == 0xFF:
+                self._listing = True
+                return None
+            return bytearray([0x00])
+        self.tag.select()
+        self.selected = self.tag
+        uid = self.tag.uid
+        return bytearray([0x01, 0x01]) + self.tag.atqa + bytearray([self.tag.sak, len(uid)]) + uid
+
+    def _to_tag(self, handler, data):
+        if not handler or self.selected is not self.tag:
+            return bytearray([STATUS_TIMEOUT])
+        try:
+            return bytearray([STATUS_OK]) + handler(bytearray(data))
+        except TagAuthFailed:
+            return bytearray([STATUS_AUTH_ERROR])
+        except TagHalted:
+            return bytearray([STATUS_TIMEOUT])
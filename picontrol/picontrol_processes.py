@@ -1,70 +1,200 @@
-import sys, psutil, os, re, subprocess, time, ConfigParser, socket, threading
+import sys, os, errno, signal, json, subprocess, time, ConfigParser, socket, threading
+import picontrol_procindex as procindex
+import picontrol_romindex as romindex
+
+# emulators and frontends that are stopped by name when no game session is
+# recorded, e.g. emulationstation started at boot or a game started from it
+EMULATOR_PROCNAMES = ["retroarch", "ags", "uae4all2", "uae4arm", "capricerpi", "linapple", "hatari", "stella",
+                    "atari800", "xroar", "vice", "daphne", "reicast", "pifba", "osmose", "gpsp", "jzintv",
+                    "basiliskll", "mame", "advmame", "dgen", "openmsx", "mupen64plus", "gngeo", "dosbox", "ppsspp",
+                    "simcoupe", "scummvm", "snes9x", "pisnes", "frotz", "fbzx", "fuse", "gemrb", "cgenesis", "zdoom",
+                    "eduke32", "lincity", "love", "alephone", "micropolis", "openbor", "openttd", "opentyrian",
+                    "cannonball", "tyrquake", "ioquake3", "residualvm", "xrick", "sdlpop", "uqm", "stratagus",
+                    "wolf4sdl", "solarus", "emulationstation"]
+
+# kodi needs SIGKILL to close
+KILL_PROCNAMES = ["kodi", "kodi.bin"]
+
+# seconds a game gets to exit after SIGTERM before it is killed
+STOP_TIMEOUT = 3.0
+
+# seconds a process lookup may reuse the /proc index, callers that poll
+# process_exists share one scan. Stopping processes always rescans
+LOOKUP_MAX_AGE = 0.5
+
+# the game started by runGame, shared by the button scripts and the webserver.
+# The game runs in a process group of its own but stays in the session of
+# tty1 that autostart.sh started us in, runcommand needs its /dev/tty
+sessionPath = '/dev/shm/picontrol_session.json'
+
+def signalPids(pids, sig):
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except OSError as e:
+            # started by another user
+            if e.errno == errno.EPERM:
+                subprocess.call(["sudo", "kill", "-" + str(int(sig)), str(pid)])
+
+def waitPids(pids, timeout):
+    # wait until pids have exited, returns the ones still running at the deadline
+    deadline = time.time() + timeout
+    while True:
+        pids = [pid for pid in pids if procindex.isRunning(pid)]
+        if not pids or time.time() >= deadline:
+            return pids
+        time.sleep(0.02)
 
 ## killTasks
-def killTasks(procnames):
+def killTasks(procnames, timeout=STOP_TIMEOUT):
+    # SIGTERM every process with one of procnames, SIGKILL the ones still
+    # running after timeout
     try:
-        for proc in psutil.process_iter():
-            if proc.name() in procnames:
-                pid = str(proc.as_dict(attrs=['pid'])['pid'])
-                name = proc.as_dict(attrs=['name'])['name']
-                subprocess.call(["sudo", "kill", "-15", pid])
-    
-        kodiproc = ["kodi", "kodi.bin"]  # kodi needs SIGKILL -9 to close
-        for proc in psutil.process_iter():
-            if proc.name() in kodiproc:
-                pid = str(proc.as_dict(attrs=['pid'])['pid'])
-                name = proc.as_dict(attrs=['name'])['name']
-                subprocess.call(["sudo", "kill", "-9", pid])
+        kodi = procindex.findByName(KILL_PROCNAMES)
+        pids = [pid for pid in procindex.findByName(procnames) if pid not in kodi]
+        signalPids(pids, signal.SIGTERM)
+        signalPids(kodi, signal.SIGKILL)
+        signalPids(waitPids(pids, timeout), signal.SIGKILL)
     except:
         pass
 
+def readSession():
+    try:
+        with open(sessionPath) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def writeSession(pgid, console, game, source):
+    session = {'pgid': pgid, 'starttime': None, 'console': console, 'game': game, 'source': source,
+               'started': time.time()}
+    try:
+        session['starttime'] = procindex.index.readStat(pgid)[0]
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    tmpPath = sessionPath + '.tmp'
+    try:
+        with open(tmpPath, 'w') as f:
+            json.dump(session, f)
+        os.rename(tmpPath, sessionPath)
+    except (IOError, OSError):
+        pass
+
+def removeSession():
+    try:
+        os.remove(sessionPath)
+    except OSError:
+        pass
+
+def signalGroup(pgid, sig):
+    try:
+        os.killpg(pgid, sig)
+    except OSError as e:
+        if e.errno == errno.EPERM:
+            subprocess.call(["sudo", "kill", "-" + str(int(sig)), "--", "-" + str(pgid)])
+
+def gameProcessGroup():
+    # preexec_fn of a game: a process group of its own inside our session,
+    # made the foreground group of the terminal so runcommand can read and
+    # write /dev/tty. Processes without a terminal just get the group
+    os.setpgid(0, 0)
+    try:
+        tty = os.open('/dev/tty', os.O_RDWR)
+    except OSError:
+        return
+    try:
+        # a background group changing the foreground group gets SIGTTOU
+        handler = signal.signal(signal.SIGTTOU, signal.SIG_IGN)
+        try:
+            os.tcsetpgrp(tty, os.getpgrp())
+        finally:
+            signal.signal(signal.SIGTTOU, handler)
+    except OSError:
+        pass
+    finally:
+        os.close(tty)
+
+def groupRunning(pgid):
+    # reap the group leader if it is our child. Zombies of the group that
+    # are left to another parent do not count
+    try:
+        os.waitpid(pgid, os.WNOHANG)
+    except OSError:
+        pass
+    try:
+        os.killpg(pgid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return False
+    return procindex.groupRunning(pgid)
+
+def waitGroup(pgid, timeout):
+    deadline = time.time() + timeout
+    while groupRunning(pgid):
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+def stopSession(timeout=STOP_TIMEOUT):
+    # SIGTERM the process group of the recorded game, SIGKILL it if it is not
+    # gone after timeout. False if there is no session to stop
+    session = readSession()
+    if session is None:
+        return False
+    removeSession()
+    pgid = session['pgid']
+    try:
+        if procindex.index.readStat(pgid)[0] != session['starttime']:
+            # the leader is gone and its pid belongs to another process now
+            return False
+    except (IOError, OSError, ValueError, IndexError):
+        # the leader is gone, the rest of the group may still run
+        pass
+    if not groupRunning(pgid):
+        return False
+    signalGroup(pgid, signal.SIGTERM)
+    if not waitGroup(pgid, timeout):
+        signalGroup(pgid, signal.SIGKILL)
+        waitGroup(pgid, 0.5)
+    return True
+
+def stopGame(timeout=STOP_TIMEOUT):
+    # stop the running game or emulationstation, by its session if runGame
+    # started it, else by name
+    if not stopSession(timeout):
+        killTasks(EMULATOR_PROCNAMES, timeout)
+
+runcommandPath = '/opt/retropie/supplementary/runcommand/runcommand.sh'
+
 ## getEmulatorPath
 def getEmulatorpath(console):
-    path = "/opt/retropie/supplementary/runcommand/runcommand.sh 0 _SYS_ " + console + " "
-    return path
+    # runcommand argv up to the rom, it is executed without a shell
+    return [runcommandPath, '0', '_SYS_', console]
 
 ## getGamePath
 def getGamePath(console, game):
-    # escape the spaces and brackets in game filename
-    game = game.replace(" ", "\ ")
-    game = game.replace("(", "\(")
-    game = game.replace(")", "\)")
-    game = game.replace("'", "\\'")
- 
-    gamePath = "/home/pi/RetroPie/roms/" + console + "/" + game
-    return gamePath
+    # the rom goes to runcommand as one argument, nothing needs escaping
+    return os.path.join(romindex.romPath, console, game)
+
+def reap(proc):
+    # wait for a launched game in the background so it does not stay a
+    # zombie of the long running button and web processes
+    reaper = threading.Thread(target=proc.wait)
+    reaper.daemon = True
+    reaper.start()
 
 def process_exists(proc_name):
+    # looked up in the /proc index, no ps subprocess
     try:
-        ps = subprocess.Popen("ps ax -o pid= -o args= ", shell=True, stdout=subprocess.PIPE)
-        ps_pid = ps.pid
-        output = ps.stdout.read()
-        ps.stdout.close()
-        ps.wait()
-        for line in output.split("\n"):
-            res = re.findall("(\d+) (.*)", line)
-            if res:
-                pid = int(res[0][0])
-                if proc_name in res[0][1] and pid != os.getpid() and pid != ps_pid:
-                    return True
-        return False
+        return len(procindex.find(proc_name, LOOKUP_MAX_AGE)) > 0
     except:
         return False
 
 def process_id(proc_name):
     try:
-        ps = subprocess.Popen("ps ax -o pid= -o args= ", shell=True, stdout=subprocess.PIPE)
-        ps_pid = ps.pid
-        output = ps.stdout.read()
-        ps.stdout.close()
-        ps.wait()
-        for line in output.split("\n"):
-            res = re.findall("(\d+) (.*)", line)
-            if res:
-                pid = int(res[0][0])
-                if proc_name in res[0][1] and pid != os.getpid() and pid != ps_pid:
-                    return pid
-        return 0
+        pids = procindex.find(proc_name, LOOKUP_MAX_AGE)
+        return pids[0] if pids else 0
     except:
         return 0
 
@@ -81,28 +211,20 @@ def runGame(console, game, source):
 
         emulationstationRunning = process_exists('emulationstation')
 
-        procnames = ["retroarch", "ags", "uae4all2", "uae4arm", "capricerpi", "linapple", "hatari", "stella",
-                    "atari800", "xroar", "vice", "daphne", "reicast", "pifba", "osmose", "gpsp", "jzintv",
-                    "basiliskll", "mame", "advmame", "dgen", "openmsx", "mupen64plus", "gngeo", "dosbox", "ppsspp",
-                    "simcoupe", "scummvm", "snes9x", "pisnes", "frotz", "fbzx", "fuse", "gemrb", "cgenesis", "zdoom",
-                    "eduke32", "lincity", "love", "alephone", "micropolis", "openbor", "openttd", "opentyrian",
-                    "cannonball", "tyrquake", "ioquake3", "residualvm", "xrick", "sdlpop", "uqm", "stratagus",
-                    "wolf4sdl", "solarus", "emulationstation"]
-        killTasks(procnames)
-
-        pid = os.fork()
-        if not pid:
-            try:
-                if ((emulationstationRunning == False and source == '') or console == ''):
-                    subprocess.call('emulationstation', shell=True)
-                else:
-                    subprocess.call(getEmulatorpath(console) + getGamePath(console,game), shell=True)
-            except:
-                pass
-            os._exit(0)
-        else:        
-            response = {'type':'success','data':'','message':'Successfully started game.'}
-            return response
+        stopGame()
+
+        if ((emulationstationRunning == False and source == '') or console == ''):
+            args = ['emulationstation']
+        else:
+            args = getEmulatorpath(console) + [getGamePath(console, game)]
+
+        # a process group of its own in the foreground of our terminal,
+        # stopGame signals the whole group at once
+        proc = subprocess.Popen(args, preexec_fn=gameProcessGroup, close_fds=True)
+        writeSession(proc.pid, console, game, source)
+        reap(proc)
+        response = {'type':'success','data':'','message':'Successfully started game.'}
+        return response
     except:
         return {'type':'error','data':'','message':'Failed to start game.'}
 
@@ -0,0 +1,113 @@
+import os, time, threading
+
+procPath = '/proc'
+
+# index of the running processes read straight from /proc, so looking for a
+# process needs no `ps` subprocess. Entries are keyed by pid and remember the
+# start time and name from /proc/<pid>/stat: a refresh reads the stat file of
+# every pid and only reads the command line of new processes, of a pid that
+# was reused (other start time) or of a process that exec'ed (other name).
+class ProcessIndex(object):
+    def __init__(self, path=procPath):
+        self.path = path
+        self.lock = threading.Lock()
+        # pid -> (starttime, name, args)
+        self.entries = {}
+        self.refreshedAt = 0
+
+    def readFile(self, pid, name):
+        with open(os.path.join(self.path, str(pid), name), 'rb') as f:
+            return f.read()
+
+    def readStat(self, pid):
+        # (starttime, name), the name is in brackets and may contain anything
+        stat = self.readFile(pid, 'stat').decode('utf-8', 'replace')
+        start = stat.index('(')
+        end = stat.rindex(')')
+        fields = stat[end + 2:].split()
+        # fields start at field 3 (state), starttime is field 22
+        return int(fields[19]), stat[start + 1:end]
+
+    def isRunning(self, pid):
+        # False for a process that is gone or a zombie waiting to be reaped
+        try:
+            stat = self.readFile(pid, 'stat').decode('utf-8', 'replace')
+            return stat[stat.rindex(')') + 2:][:1] not in ('Z', 'X', '')
+        except (IOError, OSError, ValueError):
+            return False
+
+    def groupRunning(self, pgid):
+        # True while a process of the group runs, zombies do not count
+        for pid in os.listdir(self.path):
+            if not pid.isdigit():
+                continue
+            try:
+                stat = self.readFile(pid, 'stat').decode('utf-8', 'replace')
+                fields = stat[stat.rindex(')') + 2:].split()
+                if int(fields[2]) == pgid and fields[0] not in ('Z', 'X'):
+                    return True
+            except (IOError, OSError, ValueError, IndexError):
+                continue
+        return False
+
+    def readArgs(self, pid, name):
+        # the command line like `ps -o args=` shows it
+        cmdline = self.readFile(pid, 'cmdline').decode('utf-8', 'replace')
+        args = ' '.join(arg for arg in cmdline.split('\0') if arg)
+        return args if args else '[' + name + ']'
+
+    def refresh(self, maxAge=0):
+        # update the entries if they are older than maxAge seconds
+        with self.lock:
+            if maxAge and time.time() - self.refreshedAt < maxAge:
+                return self.entries
+            entries = {}
+            for pid in os.listdir(self.path):
+                if not pid.isdigit():
+                    continue
+                pid = int(pid)
+                try:
+                    starttime, name = self.readStat(pid)
+                    entry = self.entries.get(pid)
+                    if entry is None or entry[0] != starttime or entry[1] != name:
+                        entry = (starttime, name, self.readArgs(pid, name))
+                except (IOError, OSError, ValueError, IndexError):
+                    # the process is gone
+                    continue
+                entries[pid] = entry
+            self.entries = entries
+            self.refreshedAt = time.time()
+            return entries
+
+    def find(self, text, maxAge=0):
+        # pids whose command line contains text, without our own
+        entries = self.refresh(maxAge)
+        own = os.getpid()
+        return sorted(pid for pid, entry in entries.items() if text in entry[2] and pid != own)
+
+    def findByName(self, names, maxAge=0):
+        # pids of the processes with one of names, as psutil's name(): the
+        # stat name, or the program of the command line where the stat name
+        # is cut to 15 characters
+        entries = self.refresh(maxAge)
+        own = os.getpid()
+        pids = []
+        for pid, entry in entries.items():
+            program = os.path.basename(entry[2].split(' ', 1)[0])
+            if pid != own and (entry[1] in names or (len(entry[1]) == 15 and program in names)):
+                pids.append(pid)
+        return sorted(pids)
+
+index = ProcessIndex()
+
+def find(text, maxAge=0):
+    return index.find(text, maxAge)
+
+def findByName(names, maxAge=0):
+    return index.findByName(names, maxAge)
+
+def isRunning(pid):
+    return index.isRunning(pid)
+
+def groupRunning(pgid):
+    return index.groupRunning(pgid)
@@ -0,0 +1,97 @@
+import os, hashlib, threading
+
+romPath = '/home/pi/RetroPie/roms'
+
+# console ids of the compact game record. Tags carry the id instead of the
+# name, so the list is append only: new consoles go at the end
+CONSOLES = ['3do', 'amiga', 'amstradcpc', 'apple2', 'arcade', 'atari2600', 'atari5200', 'atari7800',
+            'atari800', 'atarijaguar', 'atarilynx', 'atarist', 'c64', 'coco', 'coleco', 'daphne',
+            'dragon32', 'dreamcast', 'fba', 'fds', 'gamegear', 'gb', 'gba', 'gbc', 'genesis',
+            'intellivision', 'macintosh', 'mame-advmame', 'mame-libretro', 'mame-mame4all',
+            'mastersystem', 'megadrive', 'msx', 'n64', 'nds', 'neogeo', 'nes', 'ngp', 'ngpc', 'oric',
+            'pc', 'pc88', 'pc98', 'pcengine', 'pcfx', 'ports', 'psp', 'pspminis', 'psx', 'saturn',
+            'scummvm', 'sega32x', 'segacd', 'sg-1000', 'snes', 'ti99', 'trs-80', 'vectrex', 'vic20',
+            'videopac', 'virtualboy', 'wonderswan', 'wonderswancolor', 'x68000', 'zmachine',
+            'zxspectrum', 'atomiswave', 'naomi', 'pokemini', 'supervision', 'channelf', 'arcadia',
+            'famicom', 'sfc', 'tg16', 'tg-cd', 'markiii', 'kodi', 'retropie']
+
+# bytes of the rom hash on the tag
+HASH_SIZE = 4
+
+def consoleId(console):
+    # id of a console name, None for a console that has no id
+    try:
+        return CONSOLES.index(console) + 1
+    except ValueError:
+        return None
+
+def consoleName(consoleId):
+    if 1 <= consoleId <= len(CONSOLES):
+        return CONSOLES[consoleId - 1]
+    return None
+
+def romName(rom):
+    # rom file name as os.listdir returns it: utf-8 bytes on python 2, where
+    # names from the web and batch JSON come in as unicode, str on python 3
+    if str is bytes:
+        if not isinstance(rom, bytes):
+            rom = rom.encode('utf-8')
+    elif isinstance(rom, bytes):
+        rom = rom.decode('utf-8')
+    return rom
+
+def romHash(rom):
+    # short hash of the rom file name. Hashing the rom contents would mean
+    # reading every rom of a console (cd images are gigabytes) to build the index
+    rom = romName(rom)
+    if not isinstance(rom, bytes):
+        rom = rom.encode('utf-8')
+    return hashlib.sha1(rom).digest()[:HASH_SIZE]
+
+# rom hash -> file names of every console folder. A folder is listed again
+# when its mtime changes, that is when roms are added, removed or renamed
+class RomIndex(object):
+    def __init__(self, path=romPath):
+        self.path = path
+        self.lock = threading.Lock()
+        # console -> (mtime, {hash: [rom]})
+        self.consoles = {}
+
+    def entries(self, console):
+        directory = os.path.join(self.path, console)
+        try:
+            mtime = os.stat(directory).st_mtime
+            with self.lock:
+                cached = self.consoles.get(console)
+                if cached is not None and cached[0] == mtime:
+                    return cached[1]
+            roms = {}
+            for rom in sorted(os.listdir(directory)):
+                if not rom.startswith('.'):
+                    roms.setdefault(romHash(rom), []).append(rom)
+        except OSError:
+            return {}
+        with self.lock:
+            self.consoles[console] = (mtime, roms)
+        return roms
+
+    def find(self, console, hash, suffix=''):
+        # the rom of a hash, suffix picks one of several roms with that hash
+        suffix = romName(suffix)
+        for rom in self.entries(console).get(hash, []):
+            if rom.endswith(suffix):
+                return rom
+        return None
+
+    def suffix(self, console, rom):
+        # the shortest end of the file name that tells rom apart from the
+        # other roms with its hash, empty for a unique hash
+        rom = romName(rom)
+        others = [other for other in self.entries(console).get(romHash(rom), []) if other != rom]
+        for length in range(len(rom) + 1):
+            tail = rom[len(rom) - length:]
+            if not any(other.endswith(tail) for other in others):
+                return tail
+        return rom
+
+index = RomIndex()
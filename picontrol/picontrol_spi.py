@@ -0,0 +1,112 @@
+# SPI transports for the PN532 driver.
+#
+# The PN532 talks LSB first but the Raspberry Pi SPI controller can only shift
+# MSB first, which is why the driver historically used a bit-banged software
+# SPI.  SpiDevLSB drives the hardware controller through spidev and reverses
+# the bit order of every byte in software with a lookup table instead, so
+# frames move at the hardware clock rate.  It implements the same interface
+# as the Adafruit_GPIO.SPI classes and can be passed to PN532 as spi.
+#
+# BusLock serializes the transfers of several PN532 readers that share SCLK,
+# MOSI and MISO and only have their own chip select.
+import fcntl
+import os
+import threading
+
+MSBFIRST = 0
+LSBFIRST = 1
+
+# REVERSE_BITS[b] is b with its bit order reversed, used as a translate table.
+REVERSE_BITS = bytes(bytearray(int('{0:08b}'.format(i)[::-1], 2) for i in range(256)))
+
+
+class SpiDevLSB(object):
+    """Hardware SPI through the spidev kernel driver with LSB first support.
+    Chip select is left to the caller (the PN532 driver toggles its own CS
+    GPIO), so the controller's CE line does not need to be wired.
+    """
+
+    def __init__(self, port=0, device=0, max_speed_hz=1000000):
+        import spidev
+        self._device = spidev.SpiDev()
+        self._device.open(port, device)
+        self._device.max_speed_hz = max_speed_hz
+        self._device.mode = 0
+        # Not every controller supports running without CE, it only matters
+        # if CE is wired to something else.
+        try:
+            self._device.no_cs = True
+        except IOError:
+            pass
+        self._lsbfirst = False
+
+    def _translate(self, data):
+        data = bytearray(data)
+        if self._lsbfirst:
+            data = data.translate(REVERSE_BITS)
+        return data
+
+    def set_clock_hz(self, hz):
+        self._device.max_speed_hz = hz
+
+    def set_mode(self, mode):
+        self._device.mode = mode
+
+    def set_bit_order(self, order):
+        # The controller always shifts MSB first, LSB first is emulated.
+        self._lsbfirst = order == LSBFIRST
+
+    def close(self):
+        self._device.close()
+
+    def write(self, data):
+        self._device.writebytes(list(self._translate(data)))
+
+    def read(self, length):
+        return self._translate(self._device.readbytes(length))
+
+    def transfer(self, data):
+        return self._translate(self._device.xfer2(list(self._translate(data))))
+
+
+class BusLock(object):
+    """Lock held while a chip select is asserted on a shared SPI bus.  It is
+    reentrant for the thread holding it and also locks a file, so readers
+    driven by other processes (button scripts, webserver) wait for the bus
+    too.  Transfers are short, so readers that wait for a response or poll
+    for a tag interleave on the bus instead of blocking each other.
+    """
+
+    def __init__(self, path='/dev/shm/picontrol_spi.lock'):
+        self._path = path
+        self._lock = threading.RLock()
+        self._file = None
+        self._depth = 0
+
+    def acquire(self):
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1:
+            try:
+                if self._file is None:
+                    self._file = os.open(self._path, os.O_RDONLY | os.O_CREAT, 0o666)
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            except (IOError, OSError):
+                pass
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                if self._file is not None:
+                    fcntl.flock(self._file, fcntl.LOCK_UN)
+            except (IOError, OSError):
+                pass
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
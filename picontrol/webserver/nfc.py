@@ -3,40 +3,91 @@
 
 import sys, os, json
 import picontrol_nfc as nfc
-import picontrol_ndef as ndef
+import picontrol_monitor as monitor
+import picontrol_batch as batch
 
 sys.path.append('/home/pi/scripts/picontrol')
 
 class NFC():
     @staticmethod
-    def readNFC():
+    def readNFC(slot=0):
         records = []
         try:
-            response = nfc.read()
+            # the tag monitor has the tag decoded already
+            state = monitor.readState(slot)
+            if state is not None:
+                if state['uid'] is None:
+                    return { 'type':'error' , 'message':'Unable to find tag, try reseating or tapping the tag and try again.', 'data':'' }
+                return { 'type':'success' , 'message':'success', 'data':{'records':state['records']} }
+
+            response = nfc.read(slot=slot)
 
             if response.type == 'success':
-                message = response.data
-                for i in range(len(message.records)):
-                    records.append(message.records[i].value)
+                game = nfc.gameFromMessage(response.data)
+                if game is not None:
+                    records = list(game)
             
             jResponse = { 'type':response.type , 'message':response.message, 'data':{'records':records} }
         except:
             jResponse = { 'type':'error' , 'message':'No records found on the NFC Tag.', 'data':'' }
         return jResponse
 
+    @staticmethod
+    def getTag(slot=0):
+        # tag currently in the slot as published by the tag monitor
+        state = monitor.readState(slot)
+        if state is None:
+            return { 'type':'error' , 'message':'The tag monitor is not running.', 'data':'' }
+        return { 'type':'success' , 'message':'success', 'data':{'uid':state['uid'], 'records':state['records']} }
+
+    @staticmethod
+    def getSlots():
+        # tag of every slot, uid None for an empty slot and for a slot without a monitor
+        slots = []
+        for slot, state in enumerate(monitor.readStates()):
+            if state is None:
+                slots.append({'slot':slot, 'monitor':False, 'uid':None, 'records':[], 'inserted':None})
+            else:
+                slots.append({'slot':slot, 'monitor':True, 'uid':state['uid'], 'records':state['records'], 'inserted':state.get('inserted')})
+        return { 'type':'success' , 'message':'success', 'data':{'slots':slots} }
+
     @staticmethod
     def writeNFC(data):
         try:
             gameData = json.loads(data)
 
-            message = ndef.Message()
-            message.addTextRecord(gameData['console'])
-            message.addTextRecord(gameData['rom'])
-            response = nfc.write(message)
+            message = nfc.createGameMessage(gameData['console'], gameData['rom'])
+            response = nfc.write(message, slot=int(gameData.get('slot', 0)))
 
             print(response.type)
 
             jResponse = { 'type':response.type , 'message':response.message, 'data':response.data  }
         except:
             jResponse = { 'type':'error' , 'message':'Unable to write to the NFC Tag.', 'data':'' }
-        return jResponse  
\ No newline at end of file
+        return jResponse  
+
+    @staticmethod
+    def startBatch(data):
+        # data is {'games':[{'console', 'rom'}], 'slot'}, every new tag gets the next game
+        try:
+            batchData = json.loads(data)
+            games = [{'console':game['console'], 'rom':game['rom']} for game in batchData['games']]
+            if len(games) == 0:
+                return { 'type':'error' , 'message':'There are no games to write.', 'data':'' }
+            batch.start(games, int(batchData.get('slot', 0)))
+            jResponse = { 'type':'success' , 'message':'Present the tags to the reader one after another.', 'data':batch.status() }
+        except:
+            jResponse = { 'type':'error' , 'message':'Unable to start the batch.', 'data':'' }
+        return jResponse
+
+    @staticmethod
+    def getBatch():
+        status = batch.status()
+        if status is None:
+            return { 'type':'error' , 'message':'No batch has been started.', 'data':'' }
+        return { 'type':'success' , 'message':'success', 'data':status }
+
+    @staticmethod
+    def stopBatch():
+        batch.stop()
+        return NFC.getBatch()
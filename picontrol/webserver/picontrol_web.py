@@ -198,13 +198,38 @@ def runGame():
 @app.route('/api/nfc/read', methods=["GET"])
 @auth.login_required
 def readNFC():
-    return jsonify(NFC.readNFC())
+    return jsonify(NFC.readNFC(request.args.get('slot', 0, type=int)))
+
+@app.route('/api/nfc/tag', methods=["GET"])
+@auth.login_required
+def getTag():
+    return jsonify(NFC.getTag(request.args.get('slot', 0, type=int)))
+
+@app.route('/api/nfc/slots', methods=["GET"])
+@auth.login_required
+def getSlots():
+    return jsonify(NFC.getSlots())
 
 @app.route('/api/nfc/write', methods=["POST"])
 @auth.login_required
 def writeNFC():
     return jsonify(NFC.writeNFC(request.data))
 
+@app.route('/api/nfc/batch', methods=["POST"])
+@auth.login_required
+def startBatch():
+    return jsonify(NFC.startBatch(request.data))
+
+@app.route('/api/nfc/batch', methods=["GET"])
+@auth.login_required
+def getBatch():
+    return jsonify(NFC.getBatch())
+
+@app.route('/api/nfc/batch/stop', methods=["POST"])
+@auth.login_required
+def stopBatch():
+    return jsonify(NFC.stopBatch())
+
 ## init app
 if __name__ == '__main__':
     app.run(debug=False, threaded=True, host='0.0.0.0', port=8080)
\ No newline at end of file